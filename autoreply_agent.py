@@ -1,24 +1,34 @@
+import asyncio
 import json
+from itertools import islice
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain.chat_models import init_chat_model
 from dotenv import load_dotenv
 import os
 
-from googleapiclient.discovery import build
-from get_creds import get_credentials
-from email_handler import build_gmail_query, get_body_from_payload
+from gmail_service import get_gmail_service
+from llm_batching import acall_json, chunk_by_tokens, gather_limited
+from llm_cache import cache_key, llm_cache
+from metrics import timed
+from near_duplicates import collapse_near_duplicates
+from prompt_trim import trim_emails
+from rate_limit import estimate_tokens
+from triage import count_triage
+from email_handler import add_thread_context, load_window_emails
 
 
 load_dotenv()
 
 os.environ["GOOGLE_API_KEY"] = os.getenv("API_KEY")
 
-model = init_chat_model("gemini-2.0-flash", model_provider="google_genai")
+MODEL_NAME = "gemini-2.0-flash"
+model = init_chat_model(MODEL_NAME, model_provider="google_genai")
 
 # Classification prompt: yes/no
 classification_prompt = PromptTemplate.from_template("""You are an email triage assistant.
 You will receive a JSON array of email objects. For each email, decide if it NEEDS a reply (YES/NO).
+An email may include 'earlier_in_thread': a digest of the earlier messages in its conversation, oldest first ("You" is the user). Use it as context, but decide based on the latest message (its 'body').
 
 Input Emails (JSON):
 {emails_json}
@@ -51,6 +61,7 @@ classify_chain = classification_prompt | model | StrOutputParser()
 draft_prompt = PromptTemplate.from_template("""You are a helpful email assistant that drafts professional replies.
 Avoid jargon and use simple, human language and natural tone.
 You will receive a JSON array of email objects that require a reply. For each email, draft a concise but friendly reply, addressing the sender's points.
+If an email includes 'earlier_in_thread' (a digest of the earlier messages in the conversation, oldest first, where "You" is the user), use it so the reply fits the conversation.
 
 Input Emails (JSON):
 {emails_to_draft_json}
@@ -76,11 +87,106 @@ draft_chain = draft_prompt | model | StrOutputParser()
 
 
 def process_email(emails: list[dict]) -> dict:
+    """Synchronous wrapper around aprocess_email, for callers without an event loop."""
+    return asyncio.run(aprocess_email(emails))
+
+
+def _check_ids(results):
+    # every object must at least carry the id we map it back with
+    if not isinstance(results, list) or not all(isinstance(res, dict) and 'id' in res for res in results):
+        raise ValueError("expected a JSON array of objects with an 'id'")
+
+
+async def _classify_chunk(chunk):
+    emails_json_str = json.dumps(chunk)
+    # queue for Gemini quota instead of failing the whole request on a 429
+    classified_results = await acall_json(
+        lambda: classify_chain.ainvoke({"emails_json": emails_json_str}),
+        estimate_tokens(emails_json_str), validate=_check_ids, label="classification")
+    if classified_results is None:
+        return None
+    return {res['id']: res for res in classified_results}
+
+
+async def _draft_chunk(chunk):
+    emails_to_draft_json_str = json.dumps(chunk)
+    drafted_results = await acall_json(
+        lambda: draft_chain.ainvoke({"emails_to_draft_json": emails_to_draft_json_str}),
+        estimate_tokens(emails_to_draft_json_str), validate=_check_ids, label="drafting")
+    # Continue without drafts if parsing fails
+    return {res['id']: res for res in drafted_results or []}
+
+
+def _classify_key(email):
+    return cache_key('classify', email, classification_prompt.template, MODEL_NAME, email['id'])
+
+
+def _draft_key(email):
+    return cache_key('draft', email, draft_prompt.template, MODEL_NAME, email['id'])
+
+
+def _result_from(classification):
+    return {
+        "sender": classification.get('from', 'Unknown Sender'),
+        "needs_reply": classification.get('needs_reply', False),
+        "classification_rationale": classification.get('reason', 'No rationale provided'),
+        "draft": None,
+    }
+
+
+def _no_events(event, data):
+    pass
+
+
+def _emit_classification(emit, email_id, result):
+    emit("classification", {"id": email_id, **{key: value for key, value in result.items() if key != "draft"}})
+
+
+async def _draft_into(results, emails_to_draft, emit=_no_events):
+    drafted_map = await _draft_chunk(emails_to_draft)
+    for email in emails_to_draft:
+        draft = drafted_map.get(email['id'], {}).get('draft')
+        if isinstance(draft, str):
+            results[email['id']]['draft'] = draft.strip()
+            await llm_cache.aset(_draft_key(email), draft.strip())
+            emit("draft", {"id": email['id'], "draft": draft.strip()})
+
+
+async def _process_chunk(results, chunk, emit=_no_events):
+    # 1) Classify the chunk
+    classified_map = await _classify_chunk(chunk)
+    if classified_map is None:
+        # Fallback: assume no replies needed for this chunk only
+        for email in chunk:
+            results[email['id']] = {"sender": email['from'], "needs_reply": False, "classification_rationale": "JSON parsing failed", "draft": None}
+            _emit_classification(emit, email['id'], results[email['id']])
+        return
+
+    for email in chunk:
+        classification = classified_map.get(email['id'])
+        if classification is not None:
+            await llm_cache.aset(_classify_key(email), classification)
+        results[email['id']] = _result_from(classification or {})
+        _emit_classification(emit, email['id'], results[email['id']])
+
+    # 2) If any emails need a reply, draft them in one call
+    emails_to_draft = [email for email in chunk if results[email['id']]['needs_reply']]
+    if emails_to_draft:
+        await _draft_into(results, emails_to_draft, emit)
+
+
+async def aprocess_email(emails: list[dict], on_event=None) -> dict:
     """
-    Processes a list of emails in a batch for classification and drafting.
+    Processes a list of emails for classification and drafting. Results cached
+    from earlier runs are reused; the rest are split into chunks that fit the
+    LLM token budget, and the chunks are classified and drafted in parallel.
     Args:
         emails: A list of dictionaries, where each dictionary represents an email
-                and must contain 'id', 'subject', and 'body' keys.
+                and must contain 'id', 'subject', and 'body' keys. Emails with a
+                'triage' rationale (set by the header pre-triage) skip the model.
+        on_event: Optional callback(event, data), called with a "classification"
+                  event per email and a "draft" event per draft as soon as
+                  each is known.
     Returns:
         A dictionary where keys are email IDs and values are dictionaries
         containing 'needs_reply', 'classification_rationale', and 'draft' (if any).
@@ -88,128 +194,103 @@ def process_email(emails: list[dict]) -> dict:
     if not emails:
         return {}
 
+    results = {}
+
+    # Mail the header rules already ruled out never reaches the model
+    for email in emails:
+        if email.get('triage'):
+            results[email['id']] = {"sender": email['from'], "needs_reply": False, "classification_rationale": email['triage'], "draft": None}
+    count_triage('llm_skipped', len(results))
+
+    # One classification (and at most one draft) per thread: the newest message
+    # speaks for the thread, and earlier ones reach the model as its digest
+    latest_in_thread = {}
+    for email in emails:
+        thread_id = email.get('thread_id')
+        if email['id'] in results or not thread_id:
+            continue
+        current = latest_in_thread.get(thread_id)
+        if current is None or email.get('internal_date', 0) > current.get('internal_date', 0):
+            latest_in_thread[thread_id] = email
+    for email in emails:
+        latest = latest_in_thread.get(email.get('thread_id'))
+        if email['id'] not in results and latest is not None and latest is not email:
+            results[email['id']] = {"sender": email['from'], "needs_reply": False, "classification_rationale": f"Earlier message in the thread; handled with {latest['id']}", "draft": None}
+
     # Prepare emails for classification
     emails_for_classification = []
     for email in emails:
-        emails_for_classification.append({
+        if email['id'] in results:
+            continue
+        email_for_llm = {
             "id": email['id'],
             "from": email['from'],
             "subject": email['subject'],
             "body": email['body']
-        })
-    emails_json_str = json.dumps(emails_for_classification)
-
-    # 1) Classify all emails in batch
-    classification_raw_output = classify_chain.invoke(
-        {"emails_json": emails_json_str})
-
-    cleaned_classification_output = classification_raw_output.strip()
-    if cleaned_classification_output.startswith("```json") and cleaned_classification_output.endswith("```"):
-        cleaned_classification_output = cleaned_classification_output[len(
-            "```json"):-len("```")].strip()
-
-    try:
-        classified_results = json.loads(cleaned_classification_output)
-    except json.JSONDecodeError as e:
-        print(
-            f"Error decoding classification JSON: {cleaned_classification_output} \n{repr(e)}")
-        # Fallback or error handling: assume no replies needed if parsing fails
-        return {email['id']: {"needs_reply": False, "classification_rationale": "JSON parsing failed", "draft": None} for email in emails}
-
-    # Map classified results by ID for easy lookup
-    classified_map = {res['id']: res for res in classified_results}
-
-    # Prepare results structure
-    final_results = {email['id']: {
-        "sender": classified_map.get(email['id'], {}).get('from', 'Unknown Sender'),
-        "needs_reply": classified_map.get(email['id'], {}).get('needs_reply', False),
-        "classification_rationale": classified_map.get(email['id'], {}).get('reason', 'No rationale provided'),
-        "draft": None,
-    } for email in emails}
-
-    # Identify emails that need a reply for drafting
-    emails_to_draft = []
-    for email in emails:
-        if final_results[email['id']]['needs_reply']:
-            emails_to_draft.append({
-                "id": email['id'],
-                "from": email['from'],
-                "subject": email['subject'],
-                "body": email['body']
-            })
-
-    # 2) If any emails need a reply, generate drafts in batch
-    if emails_to_draft:
-        emails_to_draft_json_str = json.dumps(emails_to_draft)
-
-        drafting_raw_output = draft_chain.invoke(
-            {"emails_to_draft_json": emails_to_draft_json_str})
-
-        # Clean the output by removing markdown code block wrappers
-        cleaned_drafting_output = drafting_raw_output.strip()
-        if cleaned_drafting_output.startswith("```json") and cleaned_drafting_output.endswith("```"):
-            cleaned_drafting_output = cleaned_drafting_output[len(
-                "```json"):-len("```")].strip()
-
-        try:
-            drafted_results = json.loads(cleaned_drafting_output)
-        except json.JSONDecodeError:
-            print(f"Error decoding drafting JSON: {cleaned_drafting_output}")
-            # Continue without drafts if parsing fails
-            drafted_results = []
-
-        # Map drafted results by ID
-        drafted_map = {res['id']: res for res in drafted_results}
-
-        # Update final results with drafts
-        for email_id, result_data in final_results.items():
-            if result_data['needs_reply'] and email_id in drafted_map:
-                final_results[email_id]['draft'] = drafted_map[email_id]['draft'].strip(
-                )
-
-    return final_results
-
-
-def fetch_emails(user_email, timezone, since_hour=9, max_results=100):
-
-    creds = get_credentials(user_email)
-    if not creds:
-        print("Could not get credentials. Please check your setup.")
-        return []
-    service = build('gmail', 'v1', credentials=creds)
-
-    query = build_gmail_query(timezone, since_hour)
+        }
+        if email.get('earlier_in_thread'):
+            email_for_llm["earlier_in_thread"] = email['earlier_in_thread']
+        emails_for_classification.append(email_for_llm)
+    # quoted history, signatures and footers only cost tokens
+    # (CPU-bound on large batches, so off the event loop like the summary path)
+    emails_for_classification = await asyncio.to_thread(trim_emails, emails_for_classification, 'classification')
+
+    # Near-duplicates (repeated notifications, resends) ride along with one representative.
+    # Numbers count here: a second invoice from the same person needs its own answer.
+    senders = {email['id']: email['from'] for email in emails}
+    representatives = await asyncio.to_thread(
+        collapse_near_duplicates, emails_for_classification, mask_digits=False)
+    for rep in representatives:
+        for member_id in rep['member_ids'][1:]:
+            results[member_id] = {"sender": senders[member_id], "needs_reply": False, "classification_rationale": f"Near-duplicate of {rep['id']}, handled with it", "draft": None}
+    emails_for_classification = [
+        {key: value for key, value in rep.items() if key not in ("count", "member_ids")} for rep in representatives]
+
+    # Only cache misses go to the model
+    to_classify, to_draft = [], []
+    for email in emails_for_classification:
+        classification = await llm_cache.aget(_classify_key(email))
+        if classification is None:
+            to_classify.append(email)
+            continue
+        results[email['id']] = _result_from(classification)
+        if results[email['id']]['needs_reply']:
+            draft = await llm_cache.aget(_draft_key(email))
+            if draft is None:
+                to_draft.append(email)
+            else:
+                results[email['id']]['draft'] = draft
+
+    # everything settled without the model goes out straight away
+    emit = on_event or _no_events
+    for email_id, result in results.items():
+        _emit_classification(emit, email_id, result)
+        if result['draft'] is not None:
+            emit("draft", {"id": email_id, "draft": result['draft']})
+
+    calls = [_process_chunk(results, chunk, emit) for chunk in chunk_by_tokens(to_classify)]
+    calls += [_draft_into(results, chunk, emit) for chunk in chunk_by_tokens(to_draft)]
+    await gather_limited(calls)
+
+    return {email['id']: results[email['id']] for email in emails}
+
+
+def fetch_emails(user_email, timezone, since_hour=9, max_results=None):
+
+    service = get_gmail_service(user_email)
 
     try:
-        results = service.users().messages().list(
-            userId='me', q=query, maxResults=max_results).execute()
-        messages = results.get('messages', [])
+        emails = list(islice(load_window_emails(service, user_email, timezone, since_hour), max_results))
     except Exception as e:
         print(f"Error fetching emails: {e}")
         return []
 
-    emails_data = []
-    if not messages:
-        return emails_data
-
-    for msg in messages:
-        msg_data = service.users().messages().get(
-            userId='me', id=msg['id'], format='full').execute()
-        headers = msg_data['payload'].get('headers', [])
-        subject = next((h['value']
-                       for h in headers if h['name'] == 'Subject'), 'No Subject')
-        sender = next((h['value'] for h in headers if h['name']
-                      == 'From'), 'Unknown Sender')
-        body = get_body_from_payload(msg_data['payload'])
-
-        emails_data.append({
-            'id': msg['id'],
-            'from': sender,
-            'subject': subject,
-            'body': body
-        })
-
-    return emails_data
+    try:
+        # one batched threads.get per conversation, for the context of earlier replies
+        return add_thread_context(service, emails)
+    except Exception as e:
+        print(f"Error fetching thread context: {e}")
+        return emails
 
 
 def run_autoresponder(user_email, timezone, since_hour):
@@ -232,6 +313,27 @@ def run_autoresponder(user_email, timezone, since_hour):
 
     return processed_results
 
+
+async def arun_autoresponder(user_email, timezone, since_hour, progress=None, on_event=None):
+    # Gmail and the local store are blocking, so they run on the I/O thread pool;
+    # the LLM calls are awaited directly.
+    progress = progress or (lambda stage: None)
+
+    print(f"Fetching emails for {user_email} in timezone {timezone}...")
+    progress("fetching emails")
+    with timed('pipeline', 'auto_respond_fetch'):
+        emails = await asyncio.to_thread(fetch_emails, user_email, timezone, since_hour)
+
+    if not emails:
+        print("No new emails to process.")
+        return
+
+    print(f"Found {len(emails)} emails to process.")
+    progress(f"processing {len(emails)} emails")
+
+    with timed('pipeline', 'auto_respond_llm'):
+        return await aprocess_email(emails, on_event)
+
     # for email in emails:  # Iterate through original emails to maintain order and access original 'from'
     #     email_id = email['id']
     #     result = processed_results.get(email_id)
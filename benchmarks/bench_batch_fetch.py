@@ -0,0 +1,50 @@
+"""
+Compares hydrating a day's worth of mail with one messages.get per email against
+the batched fetch layer in gmail_fetch.py, using the local fake Gmail server.
+
+    python benchmarks/bench_batch_fetch.py --messages 100 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_gmail import FakeGmailServer, build_fake_service, make_mailbox  # noqa: E402
+from gmail_fetch import hydrate_messages, list_message_ids  # noqa: E402
+
+
+def fetch_serial(service, message_ids):
+    return [service.users().messages().get(userId='me', id=msg_id, format='full').execute()
+            for msg_id in message_ids]
+
+
+def run(name, fn, server, service, message_ids):
+    server.gmail.http_requests = 0
+    start = time.perf_counter()
+    messages = fn(service, message_ids)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>8}: {len(messages):4d} messages in {elapsed:7.3f}s "
+          f"({server.gmail.http_requests} HTTP round trips)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='simulated seconds per HTTP round trip')
+    args = parser.parse_args()
+
+    with FakeGmailServer(make_mailbox(args.messages), latency=args.latency) as server:
+        service = build_fake_service(server.url)
+        message_ids = list_message_ids(service, 'in:inbox', max_results=args.messages)
+
+        serial = run('serial', fetch_serial, server, service, message_ids)
+        batched = run('batched', hydrate_messages, server, service, message_ids)
+        print(f"speedup: {serial / batched:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""
+End-to-end benchmark of the HTTP endpoints with every outside service replaced
+by a local stand-in: the fake Gmail server (in its own process, with
+--gmail-latency per request), FakeSupabase over an in-memory token table, and
+the stub LLMs (--llm-latency per call plus --token-latency per output token).
+
+For each inbox size a synthetic mailbox is generated (synthetic_mailbox.py),
+and every (endpoint, concurrency) pair runs in a fresh worker process, so the
+peak memory reported belongs to that run alone. A run fires `concurrency`
+simultaneous requests, one per user, twice: cold (empty local store,
+credentials read through the token table) and warm (the same users again).
+The LLM result cache is off unless --llm-cache is given, since every user
+shares one mailbox and would otherwise hit each other's cached results.
+
+Results are printed and saved as JSON under benchmarks/results/; --compare
+prints the change from an earlier result file.
+
+    python benchmarks/bench_e2e.py --sizes 50,500 --concurrency 1,10,50
+    python benchmarks/bench_e2e.py --endpoints summarize --compare benchmarks/results/e2e-20240101-120000.json
+    python benchmarks/bench_e2e.py --report new.json --compare old.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gmail import FakeGmailProcess  # noqa: E402
+from stubs import ROOT, calls, install_stubs, make_token_table, prepare_env  # noqa: E402
+from synthetic_mailbox import DEFAULT_MIX, generate_mailbox, parse_mix  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# endpoint name -> (HTTP method, path, extra query params)
+ENDPOINTS = {
+    'no_of_emails': ('GET', '/api/no_of_emails', {'mode': 'exact'}),
+    'summarize': ('POST', '/api/summarize', {}),
+    'auto_respond': ('POST', '/api/auto_respond', {}),
+}
+PASSES = ('cold', 'warm')
+
+
+def _ints(text):
+    return [int(value) for value in text.split(',') if value.strip()]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def summarize_pass(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50': round(statistics.median(latencies), 4),
+        'p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 4),
+        'mean': round(statistics.fmean(latencies), 4),
+    }
+
+
+async def fire(app, endpoint, users):
+    import httpx
+
+    method, path, extra = ENDPOINTS[endpoint]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        async def one(user):
+            start = time.perf_counter()
+            res = await client.request(method, path, params=dict(
+                extra, user_email=user, timezone='UTC', since_hour=0))
+            return time.perf_counter() - start, res.status_code >= 400
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(one(user) for user in users))
+        elapsed = time.perf_counter() - start
+    return summarize_pass([latency for latency, _ in outcomes], sum(failed for _, failed in outcomes), elapsed)
+
+
+def run_worker(config):
+    """One (size, endpoint, concurrency) run, in its own process. Returns the result dict."""
+    prepare_env(config['gmail_url'])
+    if not config['llm_cache']:
+        os.environ['LLM_CACHE_MAX_ENTRIES'] = '0'
+    import main as backend
+
+    users = [f'user{i}@example.com' for i in range(config['concurrency'])]
+    table = make_token_table(users)
+    install_stubs(users, config['llm_latency'], config['token_latency'], table, config['supabase_latency'])
+
+    async def run():
+        await backend.configure_io_pool()
+        result = {'rss_start_mb': round(peak_rss_mb(), 1), 'calls': {}}
+        for name in PASSES:
+            before = dict(calls)
+            result[name] = await fire(backend.app, config['endpoint'], users)
+            result['calls'][name] = {kind: count - before.get(kind, 0) for kind, count in calls.items()
+                                     if count != before.get(kind, 0)}
+        result['rss_peak_mb'] = round(peak_rss_mb(), 1)
+        return result
+
+    try:
+        return asyncio.run(run())
+    finally:
+        backend.stop_parse_pool()
+
+
+def spawn_worker(config, verbose):
+    with tempfile.NamedTemporaryFile('r', suffix='.json') as out:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', json.dumps(config), '--worker-output', out.name],
+            check=True, stdout=None if verbose else subprocess.DEVNULL)
+        return json.load(out)
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    config = {
+        'sizes': args.sizes, 'concurrency': args.concurrency, 'endpoints': args.endpoints,
+        'gmail_latency': args.gmail_latency, 'llm_latency': args.llm_latency,
+        'token_latency': args.token_latency, 'supabase_latency': args.supabase_latency,
+        'html_kb': args.html_kb, 'mix': args.mix, 'thread_size': args.thread_size,
+        'seed': args.seed, 'llm_cache': args.llm_cache,
+    }
+    results = {
+        'meta': {
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git('rev-parse', '--short', 'HEAD'),
+            'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'config': config,
+        'runs': [],
+    }
+
+    for size in args.sizes:
+        # one second apart, so the whole mailbox falls inside today's window
+        messages = generate_mailbox(size, args.mix, args.html_kb, args.seed, spacing=1,
+                                    thread_size=args.thread_size)
+        with FakeGmailProcess(messages, latency=args.gmail_latency) as server:
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    worker_config = dict(config, gmail_url=server.url, endpoint=endpoint, concurrency=concurrency)
+                    run = dict(size=size, endpoint=endpoint, concurrency=concurrency,
+                               **spawn_worker(worker_config, args.verbose))
+                    results['runs'].append(run)
+                    print(_row(run))
+    return results
+
+
+HEADER = (f"{'size':>6} {'endpoint':>13} {'conc':>5} {'pass':>5} {'req/s':>8} {'p50 s':>7} "
+          f"{'p99 s':>7} {'errors':>6} {'peak MB':>8}  stub calls")
+
+
+def _row(run):
+    lines = []
+    for name in PASSES:
+        stats = run[name]
+        stub_calls = ', '.join(f'{kind} {count}' for kind, count in sorted(run['calls'][name].items())) or '-'
+        lines.append(f"{run['size']:>6} {run['endpoint']:>13} {run['concurrency']:>5} {name:>5} "
+                     f"{stats['throughput']:>8.1f} {stats['p50']:>7.3f} {stats['p99']:>7.3f} "
+                     f"{stats['errors']:>6} {run['rss_peak_mb']:>8.1f}  {stub_calls}")
+    return '\n'.join(lines)
+
+
+def print_report(results):
+    meta = results['meta']
+    print(f"commit {meta['commit']}{' (dirty)' if meta['dirty'] else ''}, Python {meta['python']}, "
+          f"{meta['cpus']} CPUs, {meta['started']}")
+    print(HEADER)
+    for run in results['runs']:
+        print(_row(run))
+
+
+def _change(old, new):
+    if not old or new is None:
+        return '     n/a'
+    return f'{100 * (new - old) / old:+7.1f}%'
+
+
+def print_comparison(old, new):
+    """Percentage change per run from `old` to `new`; lower latency and memory, higher req/s are better."""
+    print(f"\nchange from {old['meta']['commit']} ({old['meta']['started']}) "
+          f"to {new['meta']['commit']} ({new['meta']['started']})")
+    differing = sorted(key for key in set(old['config']) | set(new['config'])
+                       if key not in ('sizes', 'concurrency', 'endpoints')
+                       and old['config'].get(key) != new['config'].get(key))
+    if differing:
+        print(f"warning: the runs used different settings for {', '.join(differing)}")
+
+    old_runs = {(run['size'], run['endpoint'], run['concurrency']): run for run in old['runs']}
+    print(f"{'size':>6} {'endpoint':>13} {'conc':>5} {'pass':>5} {'req/s':>8} {'p50':>8} {'p99':>8} {'peak MB':>8}")
+    for run in new['runs']:
+        before = old_runs.get((run['size'], run['endpoint'], run['concurrency']))
+        if before is None:
+            continue
+        for name in PASSES:
+            print(f"{run['size']:>6} {run['endpoint']:>13} {run['concurrency']:>5} {name:>5} "
+                  f"{_change(before[name]['throughput'], run[name]['throughput'])} "
+                  f"{_change(before[name]['p50'], run[name]['p50'])} "
+                  f"{_change(before[name]['p99'], run[name]['p99'])} "
+                  f"{_change(before['rss_peak_mb'], run['rss_peak_mb'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=_ints, default=[50, 500], help='inbox sizes, comma separated')
+    parser.add_argument('--concurrency', type=_ints, default=[1, 10, 50], help='concurrent users, comma separated')
+    parser.add_argument('--endpoints', type=lambda text: text.split(','), default=list(ENDPOINTS),
+                        help=f"comma separated, from {', '.join(ENDPOINTS)}")
+    parser.add_argument('--gmail-latency', type=float, default=0.05)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='seconds per LLM call')
+    parser.add_argument('--token-latency', type=float, default=0.002, help='extra seconds per output token')
+    parser.add_argument('--supabase-latency', type=float, default=0.02)
+    parser.add_argument('--html-kb', type=int, default=8, help='size of the HTML-only and newsletter bodies')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='MIME shape weights, e.g. plain=2,alternative=4,newsletter=1')
+    parser.add_argument('--thread-size', type=int, default=3, help='messages per conversation')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--llm-cache', action='store_true', help='leave the LLM result cache on')
+    parser.add_argument('--output', help='where to save the results (default benchmarks/results/e2e-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--report', help='print a saved results file instead of running')
+    parser.add_argument('--verbose', action='store_true', help="show the backend's own output")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_worker(json.loads(args.worker))
+        with open(args.worker_output, 'w') as f:
+            json.dump(result, f)
+        return
+
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    if args.report:
+        with open(args.report) as f:
+            results = json.load(f)
+        print_report(results)
+    else:
+        print(HEADER)
+        results = run_suite(args)
+        output = args.output or os.path.join(RESULTS_DIR, f"e2e-{datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nsaved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the ways of downloading a day's mail for the pipeline, against the
+local fake Gmail server with realistic messages (long Received/DKIM header
+blocks, multipart/alternative bodies, every fifth with an attachment):
+
+    full         format=full, no fields mask (how every fetch used to work)
+    full+mask    format=full with FULL_FIELDS
+    meta+body    metadata with METADATA_FIELDS for pre-triage, then only the body data (BODY_FIELDS)
+    meta+raw     metadata as above, then format=raw parsed with the stdlib email parser
+
+Reports response bytes and body parse time per message.
+
+    python benchmarks/bench_fetch_formats.py --messages 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from body_parser import extract_body  # noqa: E402
+from fake_gmail import FakeGmailServer, build_fake_service  # noqa: E402
+from gmail_fetch import (BODY_FIELDS, FULL_FIELDS, METADATA_FIELDS, RAW_FIELDS,  # noqa: E402
+                         hydrate_messages)
+from synthetic_mailbox import make_message  # noqa: E402
+from triage import TRIAGE_HEADERS  # noqa: E402
+
+
+def run(name, server, fetch, message_ids):
+    server.gmail.bytes_sent = 0
+    start = time.perf_counter()
+    sources, parse_seconds = fetch(message_ids)
+    elapsed = time.perf_counter() - start
+    n = len(message_ids)
+    print(f"{name:>10}: {server.gmail.bytes_sent / n / 1024:7.1f} KB/message, "
+          f"parse {1000 * parse_seconds / n:6.3f} ms/message, total {elapsed:6.3f}s ({len(sources)} bodies)")
+
+
+def parse(sources):
+    start = time.perf_counter()
+    bodies = [extract_body(source) for source in sources]
+    return bodies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--attachment-every', type=int, default=5,
+                        help='give every Nth message a PDF attachment (0 for none)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = int(time.time())
+    every = args.attachment_every
+    messages = [make_message(rng, i, now - i * 60, 'attachment' if every and i % every == 0 else 'alternative')
+                for i in range(args.messages)]
+    message_ids = [msg['id'] for msg in messages]
+
+    with FakeGmailServer(messages) as server:
+        service = build_fake_service(server.url)
+
+        def full(ids, fields=None):
+            return parse([msg['payload'] for msg in hydrate_messages(service, ids, fields=fields)])
+
+        def with_metadata(ids, format, fields):
+            hydrate_messages(service, ids, format='metadata', metadata_headers=TRIAGE_HEADERS,
+                             fields=METADATA_FIELDS)
+            fetched = hydrate_messages(service, ids, format=format, fields=fields)
+            return parse([{'raw': msg['raw']} if format == 'raw' else msg['payload'] for msg in fetched])
+
+        run('full', server, full, message_ids)
+        run('full+mask', server, lambda ids: full(ids, FULL_FIELDS), message_ids)
+        run('meta+body', server, lambda ids: with_metadata(ids, 'full', BODY_FIELDS), message_ids)
+        run('meta+raw', server, lambda ids: with_metadata(ids, 'raw', RAW_FIELDS), message_ids)
+
+
+if __name__ == '__main__':
+    main()
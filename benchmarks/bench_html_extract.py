@@ -0,0 +1,116 @@
+"""
+Micro-benchmark for HTML body extraction: the original BeautifulSoup
+extraction against the streaming extractor in html_text.py, over generated
+Gmail payloads (short personal HTML, transactional notifications and large
+marketing emails). Reports throughput and peak traced memory per extraction.
+
+    python benchmarks/bench_html_extract.py --repeat 5
+"""
+import argparse
+import base64
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_text import HTML_TEXT_MAX_CHARS, extract_text_bs4, html_to_text  # noqa: E402
+
+WORDS = ("offer sale today free shipping new account order update meeting project "
+         "invoice deadline team weekend limited exclusive members save percent").split()
+
+
+def _sentence(rng, n=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+def personal_html(rng):
+    paragraphs = ''.join(f'<p>{_sentence(rng, 20)}</p>' for _ in range(4))
+    return f'<html><body><div dir="ltr">Hi,{paragraphs}<div>Thanks,<br>Alex</div></div></body></html>'
+
+
+def notification_html(rng):
+    rows = ''.join(f'<tr><td style="padding:4px">{_sentence(rng, 4)}</td>'
+                   f'<td style="text-align:right">${rng.randint(1, 500)}.00</td></tr>' for _ in range(30))
+    return (f'<html><head><style>td{{font-family:Arial}} .x{{color:#333}}</style></head><body>'
+            f'<table width="100%">{rows}</table><p>{_sentence(rng)}</p>'
+            f'<img src="https://t.example.com/open.gif" width="1" height="1"></body></html>')
+
+
+def marketing_html(rng, products=400):
+    style = '<style>' + ''.join(f'.c{i}{{margin:{i}px;color:#{i:06x}}}' for i in range(2000)) + '</style>'
+    preheader = f'<div style="display:none;max-height:0;overflow:hidden">{_sentence(rng, 30)}</div>'
+    cards = ''.join(
+        f'<table role="presentation" class="c{i}" style="width:100%;border:0"><tr>'
+        f'<td style="padding:8px"><a href="https://shop.example.com/p/{i}?utm_source=email&amp;utm_campaign=x">'
+        f'<img src="https://cdn.example.com/{i}.jpg" alt="Product {i}" width="200"></a></td>'
+        f'<td style="font-size:14px;line-height:20px"><b>{_sentence(rng, 5)}</b><br>{_sentence(rng, 25)}'
+        f'<br><span style="color:#c00">Now &euro;{rng.randint(5, 99)}.99</span></td></tr></table>'
+        for i in range(products))
+    script = '<script type="application/ld+json">{"@context": "http://schema.org"}</script>'
+    footer = f'<div class="footer"><p>{_sentence(rng, 40)}</p><a href="#">Unsubscribe</a></div>'
+    return f'<!DOCTYPE html><html><head>{style}{script}</head><body>{preheader}{cards}{footer}</body></html>'
+
+
+def make_payload(html):
+    """A Gmail multipart/alternative payload with a text/html part."""
+    return {
+        'mimeType': 'multipart/alternative',
+        'parts': [{'mimeType': 'text/html',
+                   'body': {'data': base64.urlsafe_b64encode(html.encode()).decode()}}],
+    }
+
+
+def make_corpus(seed=7):
+    rng = random.Random(seed)
+    return {
+        'personal': [make_payload(personal_html(rng)) for _ in range(50)],
+        'notification': [make_payload(notification_html(rng)) for _ in range(50)],
+        'marketing': [make_payload(marketing_html(rng)) for _ in range(10)],
+    }
+
+
+def html_of(payload):
+    return base64.urlsafe_b64decode(payload['parts'][0]['body']['data']).decode('utf-8', errors='ignore')
+
+
+def measure(extract, documents, repeat):
+    size = sum(len(doc) for doc in documents)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for doc in documents:
+            extract(doc)
+    elapsed = time.perf_counter() - start
+
+    peak = 0
+    for doc in documents:
+        tracemalloc.start()
+        extract(doc)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return size * repeat / elapsed / 1e6, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-chars', type=int, default=HTML_TEXT_MAX_CHARS)
+    args = parser.parse_args()
+
+    extractors = [
+        ('bs4', extract_text_bs4),
+        ('stream', lambda doc: html_to_text(doc, args.max_chars)),
+    ]
+    for kind, payloads in make_corpus().items():
+        documents = [html_of(payload) for payload in payloads]
+        avg_kb = sum(len(doc) for doc in documents) / len(documents) / 1024
+        print(f"{kind} ({len(documents)} emails, {avg_kb:.0f} KB avg)")
+        for name, extract in extractors:
+            throughput, peak = measure(extract, documents, args.repeat)
+            print(f"  {name:>6}: {throughput:7.2f} MB/s, peak {peak:6.2f} MB per email")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,425 @@
+"""
+A small local stand-in for the Gmail REST API, used by the benchmarks.
+
+It serves the handful of endpoints the backend talks to (messages list/get in
+the full, metadata and raw formats, send, threads, profile, history, watch
+and batch requests, with `fields` masks applied) from an in-memory mailbox,
+and sleeps `latency` seconds per HTTP round trip so that the cost of
+sequential calls shows up the same way it does against the real API.
+"""
+import base64
+import json
+import multiprocessing
+import quopri
+import re
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+
+class LocalServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops connections under concurrent load
+    request_queue_size = 128
+    daemon_threads = True
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def _rfc822(part, depth=0):
+    # RFC 822 source for a 'full' payload, as served for format=raw; text parts
+    # are quoted-printable like most real senders'
+    headers = [f"{h['name']}: {h['value']}" for h in part.get('headers', [])
+               if h['name'].lower() not in ('content-type', 'content-transfer-encoding', 'mime-version')]
+    if depth == 0:
+        headers.append('MIME-Version: 1.0')
+    if part.get('parts'):
+        boundary = f'==fake_boundary_{depth}=='
+        headers.append(f'Content-Type: {part["mimeType"]}; boundary="{boundary}"')
+        body = ''.join(f'--{boundary}\r\n{_rfc822(sub, depth + 1)}\r\n' for sub in part['parts'])
+        body += f'--{boundary}--\r\n'
+    else:
+        body = part.get('body', {})
+        # attachments that 'full' only references by attachmentId are still part of the raw source
+        data = base64.urlsafe_b64decode(body['data']) if 'data' in body else bytes(body.get('size', 0))
+        if part['mimeType'].startswith('text/'):
+            headers += [f'Content-Type: {part["mimeType"]}; charset="utf-8"',
+                        'Content-Transfer-Encoding: quoted-printable']
+            body = quopri.encodestring(data).decode()
+        else:
+            headers += [f'Content-Type: {part["mimeType"]}', 'Content-Transfer-Encoding: base64']
+            body = base64.encodebytes(data).decode()
+        body = body.replace('\r\n', '\n').replace('\n', '\r\n')
+    return '\r\n'.join(headers) + '\r\n\r\n' + body
+
+
+_FIELD_NAME = re.compile(r'\w+')
+
+
+def _parse_fields(mask, pos=0):
+    # 'a,b/c,d(e,f)' -> {'a': {}, 'b': {'c': {}}, 'd': {'e': {}, 'f': {}}}, where {} selects the whole field
+    tree = {}
+    while pos < len(mask) and mask[pos] != ')':
+        node = tree
+        while True:
+            name = _FIELD_NAME.match(mask, pos).group(0)
+            pos += len(name)
+            node = node.setdefault(name, {})
+            if pos < len(mask) and mask[pos] == '/':
+                pos += 1
+                continue
+            break
+        if pos < len(mask) and mask[pos] == '(':
+            sub, pos = _parse_fields(mask, pos + 1)
+            node.update(sub)
+            pos += 1
+        if pos < len(mask) and mask[pos] == ',':
+            pos += 1
+    return tree, pos
+
+
+def _apply_fields(value, tree):
+    # the partial-response `fields` mask, applied the way Gmail does
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [_apply_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _apply_fields(value[key], sub) for key, sub in tree.items() if key in value}
+    return value
+
+
+def make_mailbox(n, start_ts=None):
+    """Builds `n` plain-text messages, newest first, as Gmail 'full' resources."""
+    start_ts = start_ts or int(time.time()) - n * 60
+    messages = []
+    for i in range(n):
+        internal_ms = (start_ts + i * 60) * 1000
+        messages.append({
+            'id': f'msg{i:06d}',
+            'threadId': f'thr{i:06d}',
+            'labelIds': ['INBOX', 'UNREAD'],
+            'snippet': f'Message number {i}',
+            'historyId': str(1000 + i),
+            'internalDate': str(internal_ms),
+            'sizeEstimate': 1024,
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': [
+                    {'name': 'From', 'value': f'Sender {i % 17} <sender{i % 17}@example.com>'},
+                    {'name': 'To', 'value': 'me@example.com'},
+                    {'name': 'Subject', 'value': f'Subject {i}'},
+                ],
+                'body': {'data': _b64(f'Hello,\n\nThis is message {i}.\n\nThanks')},
+            },
+        })
+    messages.reverse()
+    return messages
+
+
+class FakeGmail:
+    """In-memory mailbox plus the request routing shared by plain and batch calls."""
+
+    def __init__(self, messages, latency=0.0):
+        self.messages = {m['id']: m for m in messages}
+        self.order = [m['id'] for m in messages]
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.http_requests = 0
+        self.api_calls = 0
+        self.bytes_sent = 0
+        # history records as (history_id, record); ids at or below
+        # `history_floor` are treated as expired
+        self.history_id = max([int(m['historyId']) for m in messages] or [1000])
+        self.history = []
+        self.history_floor = 0
+        # the next `throttled` API calls are rejected as over quota
+        self.throttled = 0
+        # listener(history_id) is called after each mailbox change, like a Gmail watch
+        self.listeners = []
+        self.watches = 0
+        self.sent = []
+
+    def _record(self, kind, msg):
+        self.history_id += 1
+        ref = {'id': msg['id'], 'threadId': msg['threadId'], 'labelIds': list(msg['labelIds'])}
+        self.history.append((self.history_id, {'id': str(self.history_id), kind: [{'message': ref}]}))
+
+    def add_message(self, msg):
+        """Delivers a new message (newest first) and records it in the history."""
+        with self.lock:
+            self.messages[msg['id']] = msg
+            self.order.insert(0, msg['id'])
+            self._record('messagesAdded', msg)
+            history_id = self.history_id
+        self._notify(history_id)
+
+    def delete_message(self, msg_id):
+        with self.lock:
+            msg = self.messages.pop(msg_id)
+            self.order.remove(msg_id)
+            self._record('messagesDeleted', msg)
+            history_id = self.history_id
+        self._notify(history_id)
+
+    def _notify(self, history_id):
+        for listener in list(self.listeners):
+            listener(history_id)
+
+    def expire_history(self):
+        with self.lock:
+            self.history_floor = self.history_id
+
+    def _after(self, query):
+        match = re.search(r'after:(\d+)', query or '')
+        return int(match.group(1)) * 1000 if match else None
+
+    def list_messages(self, params):
+        after = self._after(params.get('q'))
+        ids = [i for i in self.order
+               if after is None or int(self.messages[i]['internalDate']) > after]
+        page_size = min(int(params.get('maxResults', 100)), 500)
+        start = int(params.get('pageToken') or 0)
+        page = ids[start:start + page_size]
+        body = {'resultSizeEstimate': len(ids)}
+        if page:
+            body['messages'] = [{'id': i, 'threadId': self.messages[i]['threadId']} for i in page]
+        if start + page_size < len(ids):
+            body['nextPageToken'] = str(start + page_size)
+        return 200, body
+
+    def get_message(self, msg_id, params):
+        msg = self.messages.get(msg_id)
+        if msg is None:
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        if params.get('format') == 'metadata':
+            # headers only (optionally just the requested ones), no body parts
+            wanted = {h.lower() for h in params.get('metadataHeaders', [])}
+            headers = [h for h in msg['payload']['headers'] if not wanted or h['name'].lower() in wanted]
+            return 200, dict(msg, payload={'mimeType': msg['payload']['mimeType'], 'headers': headers})
+        if params.get('format') == 'raw':
+            raw = base64.urlsafe_b64encode(_rfc822(msg['payload']).encode()).decode()
+            return 200, dict({k: v for k, v in msg.items() if k != 'payload'}, raw=raw)
+        return 200, msg
+
+    def get_thread(self, thread_id, params):
+        members = sorted((m for m in self.messages.values() if m['threadId'] == thread_id),
+                         key=lambda m: int(m['internalDate']))
+        if not members:
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        return 200, {'id': thread_id, 'messages': [self.get_message(m['id'], params)[1] for m in members]}
+
+    def get_profile(self):
+        return 200, {'emailAddress': 'me@example.com', 'messagesTotal': len(self.order),
+                     'historyId': str(self.history_id)}
+
+    def list_history(self, params):
+        start = int(params['startHistoryId'])
+        if start <= self.history_floor:
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        records = [record for hid, record in self.history if hid > start]
+        offset = int(params.get('pageToken') or 0)
+        page_size = int(params.get('maxResults', 100))
+        body = {'historyId': str(self.history_id)}
+        if records[offset:offset + page_size]:
+            body['history'] = records[offset:offset + page_size]
+        if offset + page_size < len(records):
+            body['nextPageToken'] = str(offset + page_size)
+        return 200, body
+
+    def watch(self, body):
+        with self.lock:
+            self.watches += 1
+        expiration = int((time.time() + 7 * 24 * 3600) * 1000)
+        return 200, {'historyId': str(self.history_id), 'expiration': str(expiration)}
+
+    def send_message(self, body):
+        if not body or 'raw' not in body:
+            return 400, {'error': {'code': 400, 'message': "'raw' RFC822 payload message string is required"}}
+        with self.lock:
+            self.sent.append(body)
+            n = len(self.sent)
+        return 200, {'id': f'sent{n:06d}', 'threadId': body.get('threadId') or f'sentthr{n:06d}',
+                     'labelIds': ['SENT']}
+
+    def throttle_next(self, n):
+        with self.lock:
+            self.throttled = n
+
+    def route(self, method, path, params, body=None):
+        status, payload = self._route(method, path, params, body)
+        if status == 200 and params.get('fields'):
+            payload = _apply_fields(payload, _parse_fields(params['fields'])[0])
+        return status, payload
+
+    def _route(self, method, path, params, body=None):
+        with self.lock:
+            self.api_calls += 1
+            if self.throttled > 0:
+                self.throttled -= 1
+                return 429, {'error': {'code': 429, 'message': 'Too many requests',
+                                       'errors': [{'reason': 'rateLimitExceeded'}]}}
+        if method == 'GET' and re.fullmatch(r'/gmail/v1/users/[^/]+/profile', path):
+            return self.get_profile()
+        if method == 'GET' and re.fullmatch(r'/gmail/v1/users/[^/]+/history', path):
+            return self.list_history(params)
+        if method == 'POST' and re.fullmatch(r'/gmail/v1/users/[^/]+/watch', path):
+            return self.watch(body)
+        if method == 'POST' and re.fullmatch(r'/gmail/v1/users/[^/]+/messages/send', path):
+            return self.send_message(body)
+        match = re.fullmatch(r'/gmail/v1/users/[^/]+/messages', path)
+        if method == 'GET' and match:
+            return self.list_messages(params)
+        match = re.fullmatch(r'/gmail/v1/users/[^/]+/threads/([^/]+)', path)
+        if method == 'GET' and match:
+            return self.get_thread(match.group(1), params)
+        match = re.fullmatch(r'/gmail/v1/users/[^/]+/messages/([^/]+)', path)
+        if method == 'GET' and match:
+            return self.get_message(match.group(1), params)
+        return 404, {'error': {'code': 404, 'message': f'No route for {method} {path}'}}
+
+
+def _params(query_string):
+    # metadataHeaders is the one repeated parameter we care about
+    return {k: v if k == 'metadataHeaders' else v[-1] for k, v in parse_qs(query_string).items()}
+
+
+def _handle_batch(gmail, content_type, raw_body):
+    # The batch body is multipart/mixed with one application/http part per call.
+    message = BytesParser().parsebytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + raw_body)
+    boundary = 'batch_fake_boundary'
+    out = []
+    for part in message.get_payload():
+        content_id = part['Content-ID']
+        inner = part.get_payload()
+        if isinstance(inner, list):
+            inner = inner[0].as_string()
+        request_line, _, rest = inner.lstrip().partition('\n')
+        method, target, _ = request_line.strip().split(' ', 2)
+        _, _, inner_body = rest.replace('\r\n', '\n').partition('\n\n')
+        url = urlsplit(target)
+        status, payload = gmail.route(
+            method, url.path, _params(url.query),
+            json.loads(inner_body) if inner_body.strip() else None)
+        out.append(
+            f'--{boundary}\r\n'
+            'Content-Type: application/http\r\n'
+            f'Content-ID: <response-{content_id[1:-1]}>\r\n\r\n'
+            f'HTTP/1.1 {status} {"OK" if status < 400 else "Error"}\r\n'
+            'Content-Type: application/json; charset=UTF-8\r\n\r\n'
+            f'{json.dumps(payload)}\r\n')
+    out.append(f'--{boundary}--\r\n')
+    return f'multipart/mixed; boundary={boundary}', ''.join(out).encode()
+
+
+def make_handler(gmail):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, content_type, data):
+            with gmail.lock:
+                gmail.bytes_sent += len(data)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _dispatch(self, method):
+            with gmail.lock:
+                gmail.http_requests += 1
+            if gmail.latency:
+                time.sleep(gmail.latency)
+
+            url = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            raw_body = self.rfile.read(length) if length else b''
+
+            if method == 'POST' and url.path.startswith('/batch'):
+                content_type, data = _handle_batch(
+                    gmail, self.headers['Content-Type'], raw_body)
+                return self._send(200, content_type, data)
+
+            status, payload = gmail.route(
+                method, url.path, _params(url.query),
+                json.loads(raw_body) if raw_body else None)
+            self._send(status, 'application/json; charset=UTF-8', json.dumps(payload).encode())
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+    return Handler
+
+
+class FakeGmailServer:
+    """Runs a FakeGmail on a background thread. Use as a context manager."""
+
+    def __init__(self, messages, latency=0.0, host='127.0.0.1', port=0):
+        self.gmail = FakeGmail(messages, latency)
+        self.httpd = LocalServer((host, port), make_handler(self.gmail))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _serve(messages, latency, ready):
+    server = FakeGmailServer(messages, latency)
+    ready.put(server.url)
+    server.httpd.serve_forever()
+
+
+class FakeGmailProcess:
+    """
+    Runs the fake server in a child process, so that under load its request
+    handling doesn't compete with the code being measured for the GIL.
+    """
+
+    def __init__(self, messages, latency=0.0):
+        ctx = multiprocessing.get_context('spawn')
+        self.ready = ctx.Queue()
+        self.process = ctx.Process(target=_serve, args=(messages, latency, self.ready), daemon=True)
+        self.url = None
+
+    def __enter__(self):
+        self.process.start()
+        self.url = self.ready.get(timeout=30)
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.join()
+
+
+def build_fake_service(url):
+    """Builds a real googleapiclient Gmail service that talks to the fake server."""
+    import httplib2
+    from googleapiclient import discovery_cache
+    from googleapiclient.discovery import build_from_document
+
+    # Rewrite rootUrl rather than passing api_endpoint, since the batch URI is
+    # derived from the discovery document's rootUrl and ignores client_options.
+    document = json.loads(discovery_cache.get_static_doc('gmail', 'v1'))
+    document['rootUrl'] = url
+    return build_from_document(document, http=httplib2.Http())
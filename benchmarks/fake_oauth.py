@@ -0,0 +1,74 @@
+"""
+A local stand-in for Google's OAuth token endpoint. It answers refresh_token
+grants with a new access token, after sleeping `latency` seconds.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+from fake_gmail import LocalServer
+
+
+class FakeTokenServer:
+    """Use as a context manager; point token_uri at `.url`."""
+
+    def __init__(self, latency=0.0, expires_in=3600, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.expires_in = expires_in
+        self.refreshes = 0
+        self.revoked = set()
+        self.lock = threading.Lock()
+        self.httpd = LocalServer((host, port), self._make_handler())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                form = {k: v[-1] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if form.get('grant_type') != 'refresh_token' or form.get('refresh_token') in server.revoked:
+                    status, body = 400, {'error': 'invalid_grant'}
+                else:
+                    with server.lock:
+                        server.refreshes += 1
+                    status, body = 200, {
+                        'access_token': f'ya29.{uuid.uuid4().hex}',
+                        'expires_in': server.expires_in,
+                        'token_type': 'Bearer',
+                    }
+
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/token'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
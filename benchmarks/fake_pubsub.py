@@ -0,0 +1,56 @@
+"""
+A local stand-in for the Pub/Sub push subscription behind Gmail watch
+notifications. It POSTs push envelopes to the backend's webhook, either on
+demand or whenever an attached FakeGmail mailbox changes.
+"""
+import base64
+import json
+import threading
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+
+def envelope(email_address, history_id, subscription='projects/fake/subscriptions/gmail-push'):
+    """The JSON body Pub/Sub sends to a push endpoint for one Gmail notification."""
+    data = json.dumps({'emailAddress': email_address, 'historyId': int(history_id)})
+    return {
+        'message': {
+            'data': base64.b64encode(data.encode()).decode(),
+            'messageId': uuid.uuid4().hex,
+            'publishTime': datetime.now(timezone.utc).isoformat(),
+        },
+        'subscription': subscription,
+    }
+
+
+class FakePublisher:
+    """Posts notifications to `endpoint` (the webhook URL, including any ?token=)."""
+
+    def __init__(self, endpoint, timeout=10):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.statuses = []
+
+    def publish(self, email_address, history_id):
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(envelope(email_address, history_id)).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        with self.lock:
+            self.sent += 1
+            self.statuses.append(status)
+        return status
+
+    def attach(self, gmail, email_address):
+        """Publishes a notification for `email_address` after every change to the FakeGmail `gmail`."""
+        listener = lambda history_id: self.publish(email_address, history_id)
+        gmail.listeners.append(listener)
+        return listener
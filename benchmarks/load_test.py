@@ -0,0 +1,91 @@
+"""
+Load test for the FastAPI app with local fakes for Gmail, the LLMs and the
+credential store. It fires `--concurrency` simultaneous /api/summarize calls
+(one per user, after a warm-up pass) at the async handlers in main.py, and at
+the same pipeline behind plain `def` handlers like the ones main.py used to
+have, which run on Starlette's 40-thread pool. The LLM result cache is off,
+so every measured request pays the LLM latency.
+
+    python benchmarks/load_test.py --concurrency 200 --llm-latency 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gmail import FakeGmailProcess, make_mailbox  # noqa: E402
+from stubs import install_stubs, prepare_env  # noqa: E402
+
+
+def make_sync_app():
+    from fastapi import FastAPI, Query
+
+    from email_handler import email_summarizer
+
+    app = FastAPI()
+
+    @app.post("/api/summarize")
+    def summarize_emails(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
+        return {"summary": email_summarizer(user_email, timezone, since_hour)}
+
+    return app
+
+
+async def fire(app, users):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        async def one(user):
+            start = time.perf_counter()
+            res = await client.post('/api/summarize', params={
+                'user_email': user, 'timezone': 'UTC', 'since_hour': 0})
+            res.raise_for_status()
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one(user) for user in users))
+        return time.perf_counter() - start, sorted(latencies)
+
+
+def report(name, elapsed, latencies):
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>6}: {len(latencies)} requests in {elapsed:6.2f}s "
+          f"({len(latencies) / elapsed:6.1f} req/s), p50 {statistics.median(latencies):5.2f}s, p99 {p99:5.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--gmail-latency', type=float, default=0.05)
+    parser.add_argument('--llm-latency', type=float, default=2.0)
+    args = parser.parse_args()
+
+    with FakeGmailProcess(make_mailbox(args.messages), latency=args.gmail_latency) as server:
+        prepare_env(server.url)
+        # every user shares one mailbox, so with the LLM result cache on the warm-up
+        # pass would leave nothing for the measured pass to call the LLM for
+        os.environ['LLM_CACHE_MAX_ENTRIES'] = '0'
+        import main as backend
+
+        async def run():
+            await backend.configure_io_pool()
+            for name, app, prefix in (('sync', make_sync_app(), 's'), ('async', backend.app, 'a')):
+                # distinct users per run so neither side benefits from the other's warm store
+                users = [f'{prefix}{i}@example.com' for i in range(args.concurrency)]
+                # first pass fills each user's local store; measure the steady state after it
+                install_stubs(users, 0)
+                await fire(app, users)
+                install_stubs(users, args.llm_latency)
+                report(name, *await fire(app, users))
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
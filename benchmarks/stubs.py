@@ -0,0 +1,237 @@
+"""
+Deterministic stand-ins for the LLM and credential backends, plus a helper that
+wires them (and the fake Gmail server) into the backend modules for a benchmark.
+
+LLM replies take `latency` seconds plus `token_latency` per (estimated) output
+token, like a model streaming its answer.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# calls made to the stubs, by kind ('summary', 'classify', 'draft', 'supabase')
+calls = Counter()
+_calls_lock = threading.Lock()
+
+
+def _count(kind):
+    with _calls_lock:
+        calls[kind] += 1
+
+
+def _delay(latency, token_latency, text):
+    # ~4 characters per token, as in rate_limit.estimate_tokens
+    return latency + token_latency * max(1, len(text) // 4)
+
+
+def _summary_for(contents):
+    # one point per email in the prompt, all under a single category
+    points = ["You received an email." for _ in range(max(contents.count("'subject'"), 1))]
+    return json.dumps([{"category": "Work", "points": points}])
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Models:
+    def __init__(self, latency, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+
+    def generate_content(self, model, contents, config=None):
+        _count('summary')
+        text = _summary_for(contents)
+        time.sleep(_delay(self.latency, self.token_latency, text))
+        return _Response(text)
+
+
+class _AsyncModels(_Models):
+    async def generate_content(self, model, contents, config=None):
+        _count('summary')
+        text = _summary_for(contents)
+        await asyncio.sleep(_delay(self.latency, self.token_latency, text))
+        return _Response(text)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        # the same reply as generate_content, in four pieces spread over the latency
+        _count('summary')
+        text = _summary_for(contents)
+        step = -(-len(text) // 4)
+        delay = _delay(self.latency, self.token_latency, text)
+
+        async def pieces():
+            for start in range(0, len(text), step):
+                await asyncio.sleep(delay / 4)
+                yield _Response(text[start:start + step])
+
+        return pieces()
+
+
+class _Aio:
+    def __init__(self, latency, token_latency=0.0):
+        self.models = _AsyncModels(latency, token_latency)
+
+
+class StubGenAIClient:
+    """Mimics google.genai.Client for generate_content, sync and async."""
+
+    def __init__(self, latency=1.0, token_latency=0.0):
+        self.models = _Models(latency, token_latency)
+        self.aio = _Aio(latency, token_latency)
+
+
+class StubChain:
+    """
+    Mimics a LangChain runnable (invoke / ainvoke) for the classify and draft
+    chains. Every third email needs a reply.
+    """
+
+    def __init__(self, kind, latency=1.0, token_latency=0.0):
+        self.kind = kind
+        self.latency = latency
+        self.token_latency = token_latency
+
+    def _respond(self, inputs):
+        if self.kind == 'classify':
+            emails = json.loads(inputs['emails_json'])
+            return json.dumps([{
+                'id': email['id'],
+                'from': email['from'],
+                'needs_reply': i % 3 == 0,
+                'reason': 'stub',
+            } for i, email in enumerate(emails)])
+        emails = json.loads(inputs['emails_to_draft_json'])
+        return json.dumps([{'id': email['id'], 'draft': 'Thanks, will get back to you.'}
+                           for email in emails])
+
+    def invoke(self, inputs, config=None):
+        _count(self.kind)
+        text = self._respond(inputs)
+        time.sleep(_delay(self.latency, self.token_latency, text))
+        return text
+
+    async def ainvoke(self, inputs, config=None):
+        _count(self.kind)
+        text = self._respond(inputs)
+        await asyncio.sleep(_delay(self.latency, self.token_latency, text))
+        return text
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.filters = {}
+        self.values = None
+        self.one = False
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    def update(self, values):
+        self.values = values
+        return self
+
+    def execute(self):
+        _count('supabase')
+        time.sleep(self.client.latency)
+        table = self.client.tables[self.name]
+        if self.values is not None:
+            table.write_tokens([dict(self.values, user_id=self.filters['user_id'])])
+            return _Result([])
+        with table.lock:
+            rows = [dict(row) for row in table.rows.values()
+                    if all(row.get(column) == value for column, value in self.filters.items())]
+        if self.one:
+            return _Result(rows[0] if rows else None)
+        return _Result(rows)
+
+
+class FakeSupabase:
+    """
+    Mimics the part of the Supabase client get_creds.get_credentials uses
+    (table / from_, select, eq, single, update, execute) over in-memory tables,
+    e.g. {'gmail_tokens': InMemoryTokenTable(...)}, with `latency` per query.
+    """
+
+    def __init__(self, tables, latency=0.0):
+        self.tables = tables
+        self.latency = latency
+
+    def table(self, name):
+        return _Query(self, name)
+
+    from_ = table
+
+
+def make_token_table(users, expires_in=3600):
+    """An InMemoryTokenTable with a valid token for each of `users`."""
+    from get_creds import format_expiry
+    from token_refresher import InMemoryTokenTable
+
+    expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=expires_in)
+    return InMemoryTokenTable({
+        'user_id': user, 'access_token': f'token-{i}', 'refresh_token': f'refresh-{i}',
+        'expires_at': format_expiry(expiry),
+    } for i, user in enumerate(users))
+
+
+def prepare_env(gmail_url):
+    """Sets the env the backend modules read at import time. Call before importing them."""
+    os.environ['GMAIL_API_ROOT'] = gmail_url
+    os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:9')
+    os.environ.setdefault('SUPABASE_SERVICE_ROLE_KEY', 'bench')
+    os.environ.setdefault('API_KEY', 'bench')
+    os.environ['TOKEN_REFRESHER_ENABLED'] = '0'
+    os.environ['MAILBAE_STORE_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+
+def install_stubs(users, llm_latency, token_latency=0.0, token_table=None, supabase_latency=0.0):
+    """
+    Swaps the LLM clients for stubs. Without a `token_table` it seeds the
+    credentials cache so Supabase is never hit; with one, get_creds reads the
+    table through FakeSupabase, the same way it reads Supabase in production.
+    """
+    from google.auth.credentials import AnonymousCredentials
+
+    import autoreply_agent
+    import gemini
+    import get_creds
+    import gmail_service
+
+    gemini.client = StubGenAIClient(llm_latency, token_latency)
+    autoreply_agent.classify_chain = StubChain('classify', llm_latency, token_latency)
+    autoreply_agent.draft_chain = StubChain('draft', llm_latency, token_latency)
+
+    if token_table is not None:
+        get_creds.supabase = FakeSupabase({'gmail_tokens': token_table}, supabase_latency)
+        return
+
+    for user in users:
+        creds = AnonymousCredentials()
+        creds.expiry = datetime.utcnow() + timedelta(hours=1)
+        gmail_service.store_credentials(user, creds)
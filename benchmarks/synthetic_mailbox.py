@@ -0,0 +1,157 @@
+"""
+Synthetic mailboxes for the benchmarks: Gmail 'full' message resources with
+the header block real mail servers add (Received, ARC, DKIM) and a
+configurable mix of MIME shapes and HTML weight. Generation is seeded, so
+the same arguments always give the same mailbox.
+
+Shapes:
+    plain        text/plain only
+    alternative  multipart/alternative, text and the same content as HTML
+    html         text/html only, about `html_kb` of marketing-style markup
+    attachment   multipart/mixed: an alternative body plus a PDF (referenced by attachmentId)
+    newsletter   like html, sent as bulk mail with List-Unsubscribe (pre-triage skips these)
+"""
+import base64
+import random
+import time
+
+SHAPES = ('plain', 'alternative', 'html', 'attachment', 'newsletter')
+# relative weights; roughly a working inbox
+DEFAULT_MIX = {'plain': 2, 'alternative': 4, 'html': 1, 'attachment': 1, 'newsletter': 2}
+
+WORDS = ("meeting project invoice deadline team update review please thanks order "
+         "account report schedule tomorrow budget draft client notes call").split()
+
+
+def parse_mix(text):
+    """'plain=2,html=1' -> {'plain': 2, 'html': 1}"""
+    mix = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        shape, _, weight = item.partition('=')
+        if shape not in SHAPES:
+            raise ValueError(f"Unknown shape {shape!r}, expected one of {SHAPES}")
+        mix[shape] = float(weight or 1)
+    return mix
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def _text(rng, sentences):
+    return ' '.join(' '.join(rng.choice(WORDS) for _ in range(12)).capitalize() + '.'
+                    for _ in range(sentences))
+
+
+def _leaf(part_id, mime_type, data, filename=''):
+    return {
+        'partId': part_id, 'mimeType': mime_type, 'filename': filename,
+        'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; charset="UTF-8"'},
+                    {'name': 'Content-Transfer-Encoding', 'value': 'quoted-printable'}],
+        'body': {'size': len(data), 'data': _b64(data)},
+    }
+
+
+def _marketing_html(rng, kb):
+    cards, size = [], 0
+    while size < kb * 1024:
+        card = (f'<table role="presentation" style="width:100%;border:0"><tr>'
+                f'<td style="padding:8px"><a href="https://shop.example.com/p/{len(cards)}?utm_source=email">'
+                f'<img src="https://cdn.example.com/{len(cards)}.jpg" width="200"></a></td>'
+                f'<td style="font-size:14px;line-height:20px">{_text(rng, 2)}</td></tr></table>')
+        cards.append(card)
+        size += len(card)
+    return ('<html><head><style>td{font-family:Arial}</style></head><body>' + ''.join(cards)
+            + '<p>You are receiving this because you subscribed. <a href="#">Unsubscribe</a></p></body></html>')
+
+
+def _headers(rng, i, sender, subject):
+    headers = [{'name': 'Delivered-To', 'value': 'me@example.com'}]
+    for hop in range(4):
+        headers.append({'name': 'Received', 'value': (
+            f'from mail{hop}.example.net (mail{hop}.example.net. [203.0.113.{hop}]) by mx.google.com '
+            f'with ESMTPS id {rng.getrandbits(64):x} for <me@example.com> (version=TLS1_3 '
+            f'cipher=TLS_AES_256_GCM_SHA384 bits=256/256); Mon, 1 Jan 2024 10:0{hop}:00 -0800 (PST)')})
+    return headers + [
+        {'name': 'ARC-Seal', 'value': 'i=1; a=rsa-sha256; t=1700000000; cv=none; d=google.com; s=arc-20160816; b='
+                                      + _b64(rng.randbytes(256))},
+        {'name': 'ARC-Authentication-Results', 'value': f'i=1; mx.google.com; dkim=pass header.i=@example.com; '
+                                                        f'spf=pass smtp.mailfrom={sender}; dmarc=pass'},
+        {'name': 'DKIM-Signature', 'value': 'v=1; a=rsa-sha256; c=relaxed/relaxed; d=example.com; s=s1; '
+                                            'h=from:to:subject:date:message-id; bh=' + _b64(rng.randbytes(32))
+                                            + '; b=' + _b64(rng.randbytes(256))},
+        {'name': 'Authentication-Results', 'value': 'mx.google.com; dkim=pass; spf=pass; dmarc=pass'},
+        {'name': 'From', 'value': f'Sender {i % 23} <{sender}>'},
+        {'name': 'To', 'value': 'me@example.com'},
+        {'name': 'Subject', 'value': subject},
+        {'name': 'Date', 'value': 'Mon, 1 Jan 2024 10:05:00 -0800'},
+        {'name': 'Message-ID', 'value': f'<{rng.getrandbits(96):x}@example.com>'},
+        {'name': 'MIME-Version', 'value': '1.0'},
+    ]
+
+
+def make_message(rng, i, internal_ts, shape='alternative', html_kb=8, thread_id=None):
+    """One Gmail 'full' message resource of the given shape."""
+    text = _text(rng, rng.randint(3, 30))
+    labels = ['INBOX', 'UNREAD', 'CATEGORY_PERSONAL']
+    if shape == 'newsletter':
+        sender, subject = f'news{i % 5}@shop.example.com', f'This week only: {_text(rng, 1)[:40]}'
+        labels = ['INBOX', 'UNREAD', 'CATEGORY_PROMOTIONS']
+    else:
+        sender, subject = f'sender{i % 23}@example.com', f'Re: {_text(rng, 1)[:60]}'
+    headers = _headers(rng, i, sender, subject)
+
+    if shape == 'plain':
+        body = dict(_leaf('', 'text/plain', text.encode()), headers=headers)
+    elif shape in ('html', 'newsletter'):
+        html = _marketing_html(rng, html_kb)
+        body = dict(_leaf('', 'text/html', html.encode()), headers=headers)
+        if shape == 'newsletter':
+            body['headers'] = headers + [
+                {'name': 'List-Unsubscribe', 'value': f'<https://shop.example.com/unsub/{i}>'},
+                {'name': 'Precedence', 'value': 'bulk'}]
+    else:
+        html = '<html><body><div dir="ltr">' + ''.join(
+            f'<p style="margin:0 0 12px 0;font-family:Arial">{sentence}</p>' for sentence in text.split('. ')) \
+            + '</div></body></html>'
+        alternative = {
+            'partId': '0', 'mimeType': 'multipart/alternative', 'filename': '',
+            'headers': [{'name': 'Content-Type', 'value': 'multipart/alternative; boundary="alt"'}],
+            'body': {'size': 0},
+            'parts': [_leaf('0.0', 'text/plain', text.encode()), _leaf('0.1', 'text/html', html.encode())],
+        }
+        if shape == 'attachment':
+            pdf = {
+                'partId': '1', 'mimeType': 'application/pdf', 'filename': 'report.pdf',
+                'headers': [{'name': 'Content-Type', 'value': 'application/pdf; name="report.pdf"'},
+                            {'name': 'Content-Disposition', 'value': 'attachment; filename="report.pdf"'}],
+                # like Gmail's 'full' format, the data itself is only referenced
+                'body': {'attachmentId': _b64(rng.randbytes(200)), 'size': rng.randint(50, 400) * 1024},
+            }
+            body = {'partId': '', 'mimeType': 'multipart/mixed', 'filename': '', 'headers': headers,
+                    'body': {'size': 0}, 'parts': [alternative, pdf]}
+        else:
+            body = dict(alternative, partId='', headers=headers + alternative['headers'])
+
+    return {
+        'id': f'msg{i:06d}', 'threadId': thread_id or f'thr{i:06d}', 'labelIds': labels,
+        'snippet': text[:140], 'historyId': str(1000 + i), 'internalDate': str(internal_ts * 1000),
+        'sizeEstimate': len(text) * 3 + 6000, 'payload': body,
+    }
+
+
+def generate_mailbox(n, mix=None, html_kb=8, seed=7, start_ts=None, spacing=60, thread_size=1):
+    """
+    `n` messages, newest first, `spacing` seconds apart and ending now (or
+    starting at `start_ts`). `mix` maps shapes to relative weights; consecutive
+    messages share a thread in groups of `thread_size`.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    shapes, weights = zip(*mix.items())
+    start_ts = start_ts or int(time.time()) - n * spacing
+    messages = [make_message(rng, i, start_ts + i * spacing, rng.choices(shapes, weights)[0], html_kb,
+                             f'thr{i // max(thread_size, 1):06d}')
+                for i in range(n)]
+    messages.reverse()
+    return messages
@@ -0,0 +1,163 @@
+import base64
+import email
+import email.policy
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from dotenv import load_dotenv
+
+from html_text import html_to_text
+
+load_dotenv()
+
+# Worker processes for decoding/extracting large bodies; 0 keeps all parsing inline
+PARSE_WORKERS = int(os.getenv("MIME_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Payloads with less encoded body data than this are parsed inline, where IPC would cost more than it saves
+PARSE_INLINE_BYTES = int(os.getenv("MIME_PARSE_INLINE_BYTES", str(32 * 1024)))
+
+
+def get_body_from_payload(payload):
+    # Extracts the plain text or HTML content from an email payload.
+
+    # Try top-level part first
+    mime_type = payload.get("mimeType")
+    body_data = payload.get("body", {}).get("data")
+
+    if mime_type == "text/plain" and body_data:
+        return decode_body(body_data)
+
+    if mime_type == "text/html" and body_data:
+        html_content = decode_body(body_data)
+        return extract_text_from_html(html_content)
+
+    # For multipart emails
+    def extract_parts(parts):
+        for part in parts:
+            mime_type = part.get("mimeType")
+            body_data = part.get("body", {}).get("data")
+
+            if mime_type == "text/plain" and body_data:
+                return decode_body(body_data)
+
+            if mime_type == "text/html" and body_data:
+                html_content = decode_body(body_data)
+                return extract_text_from_html(html_content)
+
+            # Recursively search nested parts (for multipart/* type emails)
+            if part.get("parts"):
+                result = extract_parts(part["parts"])
+                if result:
+                    return result
+
+        return "[No readable body found]"
+
+    return extract_parts(payload.get("parts", [])) or "[No readable body found]"
+
+
+def decode_body(data):
+    return base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
+
+
+def get_body_from_raw(raw):
+    # format='raw' messages carry the whole RFC 822 message, base64url encoded
+    message = email.message_from_bytes(base64.urlsafe_b64decode(raw), policy=email.policy.default)
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return "[No readable body found]"
+    try:
+        content = part.get_content()
+    except (LookupError, ValueError):
+        # unknown or broken charset
+        content = (part.get_payload(decode=True) or b"").decode("utf-8", errors="ignore")
+    # the source has CRLF line endings; 'full' payloads decode to plain newlines
+    content = content.replace("\r\n", "\n")
+    if part.get_content_subtype() == "html":
+        return extract_text_from_html(content)
+    return content
+
+
+def extract_body(source):
+    """Body text of a message payload, or of {'raw': ...} for a format='raw' message."""
+    if "raw" in source:
+        return get_body_from_raw(source["raw"])
+    return get_body_from_payload(source)
+
+
+def extract_text_from_html(html_content):
+    # streaming extraction, bounded to HTML_TEXT_MAX_CHARS (see html_text.py)
+    return html_to_text(html_content)
+
+
+def payload_size(payload):
+    """Bytes of encoded body data in a payload (or raw message), across all of its parts."""
+    size = len(payload.get("raw") or payload.get("body", {}).get("data") or "")
+    return size + sum(payload_size(part) for part in payload.get("parts", []))
+
+
+def _extract_bodies(payloads):
+    # runs in a worker process: raw payloads in, compact text out
+    return [extract_body(payload) for payload in payloads]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the server process has live threads and locks
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_parse_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def parse_bodies(payloads, inline_bytes=PARSE_INLINE_BYTES):
+    """
+    Returns the body text of each payload (or {'raw': ...} message), in order. Payloads with at least
+    `inline_bytes` of body data are decoded and extracted on the process pool,
+    split evenly across the workers; the rest are parsed inline meanwhile.
+    """
+    bodies = [None] * len(payloads)
+    large = [i for i, payload in enumerate(payloads) if payload_size(payload) >= inline_bytes]
+
+    futures = []
+    if PARSE_WORKERS > 0 and large:
+        try:
+            pool = _get_pool()
+            per_worker = -(-len(large) // PARSE_WORKERS)
+            for start in range(0, len(large), per_worker):
+                indexes = large[start:start + per_worker]
+                futures.append((indexes, pool.submit(_extract_bodies, [payloads[i] for i in indexes])))
+        except (BrokenProcessPool, RuntimeError) as e:
+            print(f"Parse pool unavailable, parsing inline: {e!r}")
+            shutdown_parse_pool()
+            futures = []
+
+    offloaded = {i for indexes, _ in futures for i in indexes}
+    for i, payload in enumerate(payloads):
+        if i not in offloaded:
+            bodies[i] = extract_body(payload)
+
+    for indexes, future in futures:
+        try:
+            results = future.result()
+        except BrokenProcessPool as e:
+            print(f"Parse pool failed, parsing inline: {e!r}")
+            shutdown_parse_pool()
+            results = _extract_bodies([payloads[i] for i in indexes])
+        for i, body in zip(indexes, results):
+            bodies[i] = body
+    return bodies
@@ -1,13 +1,28 @@
+import asyncio
+import html
+import os
+from collections import defaultdict
 from datetime import datetime, timedelta
+import threading
+import time
 import pytz
 import base64
-from googleapiclient.discovery import build
-from bs4 import BeautifulSoup
+from googleapiclient.errors import HttpError
 from email.mime.text import MIMEText
 from google.oauth2.credentials import Credentials
 
-from gemini import generate_summary
-from get_creds import get_credentials
+from body_parser import get_body_from_payload, parse_bodies
+from gemini import agenerate_summary, generate_summary
+from gmail_service import get_gmail_service
+from gmail_fetch import (BATCH_SIZE, BODY_FIELDS, FULL_FIELDS, METADATA_FIELDS, RAW_FIELDS, chunked,
+                         hydrate_messages, hydrate_threads, iter_messages, record_parse, send_batch)
+from mail_store import get_store
+from metrics import timed
+from near_duplicates import collapse_near_duplicates
+from prompt_trim import trim_emails
+from push_ingest import push_active
+from triage import TRIAGE_HEADERS, count_triage, enabled_rules, triage_message
+from ttl_cache import TTLCache
 
 # Scopes: change to 'readonly' if you just want to read
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
@@ -32,61 +47,10 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 #     return creds
 
 
-def get_body_from_payload(payload):
-    # Extracts the plain text or HTML content from an email payload.
-
-    # Try top-level part first
-    mime_type = payload.get("mimeType")
-    body_data = payload.get("body", {}).get("data")
-
-    if mime_type == "text/plain" and body_data:
-        return decode_body(body_data)
-
-    if mime_type == "text/html" and body_data:
-        html_content = decode_body(body_data)
-        return extract_text_from_html(html_content)
-
-    # For multipart emails
-    def extract_parts(parts):
-        for part in parts:
-            mime_type = part.get("mimeType")
-            body_data = part.get("body", {}).get("data")
-
-            if mime_type == "text/plain" and body_data:
-                return decode_body(body_data)
-
-            if mime_type == "text/html" and body_data:
-                html_content = decode_body(body_data)
-                return extract_text_from_html(html_content)
-
-            # Recursively search nested parts (for multipart/* type emails)
-            if part.get("parts"):
-                result = extract_parts(part["parts"])
-                if result:
-                    return result
-
-        return "[No readable body found]"
-
-    return extract_parts(payload.get("parts", [])) or "[No readable body found]"
-
-
-def decode_body(data):
-    return base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
-
-
-def extract_text_from_html(html_content):
-    soup = BeautifulSoup(html_content, "html.parser")
-    text = soup.get_text(separator="\n").strip()
-    lines = text.splitlines()
-    # remove excess blank lines from text, just to keep it clean
-    clean_lines = [line.strip() for line in lines if line.strip()]
-    return "\n".join(clean_lines)
-
-
-def build_gmail_query(timezone: str, since_hour: int = 9) -> str:
-    # 1. Get current time in the user’s timezone
+def get_window_start(timezone: str, since_hour: int = 9, now: float = None) -> int:
+    # 1. Get current time (or the epoch seconds `now`) in the user’s timezone
     tz = pytz.timezone(timezone)
-    now = datetime.now(tz)
+    now = datetime.fromtimestamp(now, tz) if now is not None else datetime.now(tz)
 
     # 2. Determine the correct “start day”
     #    If it's before since_hour, use yesterday; otherwise use today
@@ -102,54 +66,410 @@ def build_gmail_query(timezone: str, since_hour: int = 9) -> str:
     )
 
     # 4. Convert to Unix epoch seconds (Gmail expects seconds)
-    after_timestamp = int(start_time.timestamp())
+    return int(start_time.timestamp())
+
 
-    # 5. Return Gmail query
+def build_window_query(after_timestamp: int) -> str:
     return f"in:inbox -in:sent after:{after_timestamp}"
 
 
-def no_of_emails(user_email, timezone, since_hour=9):
-    query = build_gmail_query(timezone, since_hour)
+def build_gmail_query(timezone: str, since_hour: int = 9) -> str:
+    return build_window_query(get_window_start(timezone, since_hour))
 
-    creds = get_credentials(user_email)
-    service = build('gmail', 'v1', credentials=creds)
-    results = service.users().messages().list(
-        userId='me', q=query, maxResults=100).execute()
 
-    messages = results.get('messages', [])
-    return len(messages)
+# "exact" counts every message in the window; "estimate" is Gmail's resultSizeEstimate (one small call)
+COUNT_MODES = ('exact', 'estimate')
+# Repeated counter polls are answered from memory for this long, unless the mailbox changes first
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL_SECONDS", "30"))
+ID_PAGE_SIZE = 500
 
+count_cache = TTLCache(max_size=1024, ttl=COUNT_CACHE_TTL)
+# Bumped whenever a sync changes a user's mailbox; it is part of the count cache
+# key, so older counts for the user are never read again
+_mailbox_versions = defaultdict(int)
 
-def fetch_todays_emails_and_summarize(service, timezone, since_hour):
-    query = build_gmail_query(timezone, since_hour)  # Gmail query language
 
-    try:
+def mark_mailbox_changed(user_email):
+    _mailbox_versions[user_email] += 1
+
+
+def estimate_window_count(service, since_ts):
+    with timed('gmail', 'messages.list'):
         results = service.users().messages().list(
-            userId='me', q=query, maxResults=100).execute()
-        messages = results.get('messages', [])
+            userId='me', q=build_window_query(since_ts), maxResults=1,
+            fields='resultSizeEstimate').execute()
+    return results.get('resultSizeEstimate', 0)
+
+
+def count_window_ids(service, since_ts):
+    """Exact count of the window, paging through message ids only."""
+    count, page_token = 0, None
+    while True:
+        with timed('gmail', 'messages.list'):
+            results = service.users().messages().list(
+                userId='me', q=build_window_query(since_ts), maxResults=ID_PAGE_SIZE,
+                pageToken=page_token, fields='messages/id,nextPageToken').execute()
+        count += len(results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return count
+
+
+def _count_window(user_email, since_ts, mode):
+    service = get_gmail_service(user_email)
+    if mode == 'estimate':
+        return estimate_window_count(service, since_ts)
+
+    store = get_store()
+    state = store.get_state(user_email)
+    if state is None or state['synced_since'] > since_ts:
+        # the store doesn't cover this window; don't download every body just for a number
+        return count_window_ids(service, since_ts)
+    # the same snapshot the summary and auto-respond requests of a dashboard load read
+    return len(window_snapshot(service, user_email, since_ts))
+
+
+def no_of_emails(user_email, timezone, since_hour=9, mode='exact'):
+    if mode not in COUNT_MODES:
+        raise ValueError(f"Unknown count mode {mode!r}, expected one of {COUNT_MODES}")
+    since_ts = get_window_start(timezone, since_hour)
+
+    key = (user_email, since_ts, mode, _mailbox_versions[user_email])
+    return count_cache.get_or_load(key, lambda: _count_window(user_email, since_ts, mode))
+
+
+async def ano_of_emails(user_email, timezone, since_hour=9, mode='exact'):
+    return await asyncio.to_thread(no_of_emails, user_email, timezone, since_hour, mode)
+
+
+def get_header(headers, name, default=None):
+    # Gmail keeps the original header casing, so compare case-insensitively
+    name = name.lower()
+    return next((h['value'] for h in headers if h['name'].lower() == name), default)
+
+
+def parse_message(msg_data, triage=None, body=None):
+    headers = msg_data['payload'].get('headers', [])
+    if body is None:
+        # pre-triaged mail is only fetched as metadata, so the snippet stands in for the body
+        body = msg_data.get('snippet', '') if triage else get_body_from_payload(msg_data['payload'])
+    return {
+        'id': msg_data['id'],
+        'thread_id': msg_data.get('threadId'),
+        'internal_date': int(msg_data.get('internalDate', 0)) // 1000,
+        'labels': msg_data.get('labelIds', []),
+        'from': get_header(headers, 'From', 'Unknown Sender'),
+        'subject': get_header(headers, 'Subject', 'No Subject'),
+        'body': body,
+        'triage': triage,
+    }
+
+
+# How bodies are downloaded once pre-triage has the headers: 'full' (the JSON
+# part tree, masked down to body data) or 'raw' (the RFC 822 source, parsed
+# with the stdlib email parser). benchmarks/bench_fetch_formats.py compares them.
+GMAIL_BODY_FORMAT = os.getenv("GMAIL_BODY_FORMAT", "full")
+
+
+def _parse_bodies(messages, format):
+    start = time.perf_counter()
+    with timed('parse', format):
+        bodies = parse_bodies([{'raw': msg['raw']} if format == 'raw' else msg['payload'] for msg in messages])
+    record_parse(format, time.perf_counter() - start)
+    return bodies
+
+
+def parse_messages(messages):
+    """Parses a batch of full-format messages; large bodies are extracted on the parse pool."""
+    bodies = _parse_bodies(messages, 'full')
+    return [parse_message(msg, body=body) for msg, body in zip(messages, bodies)]
+
+
+def fetch_bodies(service, message_ids, format=None, errors=None):
+    """Downloads only the bodies of the given messages, as {id: body text}."""
+    format = format or GMAIL_BODY_FORMAT
+    messages = hydrate_messages(service, message_ids, format=format,
+                                fields=RAW_FIELDS if format == 'raw' else BODY_FIELDS, errors=errors)
+    return dict(zip((msg['id'] for msg in messages), _parse_bodies(messages, format)))
+
+
+def parse_with_triage(service, metadata_messages, errors=None):
+    """
+    Parses a batch of format='metadata' messages, downloading full bodies only
+    for the ones the pre-triage rules don't already rule out. Messages whose
+    body couldn't be downloaded are left out (and go into `errors`, if given).
+    """
+    parsed, need_body = [], []
+    for msg_data in metadata_messages:
+        rationale = triage_message(msg_data)
+        if rationale:
+            parsed.append(parse_message(msg_data, rationale))
+        else:
+            need_body.append(msg_data)
+    count_triage('bodies_skipped', len(parsed))
+
+    # the metadata already has the headers and labels, so only the bodies are downloaded
+    bodies = fetch_bodies(service, [msg_data['id'] for msg_data in need_body], errors=errors)
+    parsed.extend(parse_message(msg_data, body=bodies[msg_data['id']])
+                  for msg_data in need_body if msg_data['id'] in bodies)
+    return parsed
+
+
+def iter_parsed_messages(service, query, max_results=None, errors=None):
+    # raw payloads are parsed as they stream in and dropped straight away
+    if not enabled_rules:
+        messages = iter_messages(service, query, limit=max_results, fields=FULL_FIELDS, errors=errors)
+        for batch in chunked(messages, BATCH_SIZE):
+            yield from parse_messages(batch)
+        return
+
+    metadata = iter_messages(service, query, format='metadata', limit=max_results,
+                             metadata_headers=TRIAGE_HEADERS, fields=METADATA_FIELDS, errors=errors)
+    for batch in chunked(metadata, BATCH_SIZE):
+        yield from parse_with_triage(service, batch, errors)
+
+
+def fetch_inbox_messages(service, message_ids, errors=None):
+    """Fetches and parses the given messages, keeping only those in the inbox."""
+    if not enabled_rules:
+        return parse_messages([msg for msg in hydrate_messages(service, message_ids, fields=FULL_FIELDS,
+                                                               errors=errors)
+                               if 'INBOX' in msg.get('labelIds', [])])
+
+    metadata = hydrate_messages(service, message_ids, format='metadata', metadata_headers=TRIAGE_HEADERS,
+                                fields=METADATA_FIELDS, errors=errors)
+    return parse_with_triage(service, [msg for msg in metadata if 'INBOX' in msg.get('labelIds', [])], errors)
+
+
+# Mail older than this (relative to the oldest window asked for) is dropped from the local store
+STORE_RETENTION = 2 * 24 * 3600
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+_sync_locks = defaultdict(threading.Lock)
+
+
+def _failed_ids(user_email, errors):
+    # a 404 means the message is gone; anything else still has to be fetched
+    failed = {msg_id for msg_id, error in errors.items()
+              if not (isinstance(error, HttpError) and error.resp.status == 404)}
+    if failed:
+        print(f"Couldn't fetch {len(failed)} messages for {user_email}; the next sync retries them")
+    return failed
+
+
+def _full_sync(service, store, user_email, since_ts):
+    # Note the history id before listing, so anything that arrives while we
+    # list gets replayed by the next incremental sync.
+    with timed('gmail', 'profile'):
+        history_id = service.users().getProfile(userId='me').execute()['historyId']
+
+    store.clear_user(user_email)
+    errors = {}
+    messages = iter_parsed_messages(service, build_window_query(since_ts), errors=errors)
+    for batch in chunked(messages, BATCH_SIZE):
+        store.upsert_messages(user_email, batch)
+    # the history id moves past messages that failed to download, so remember them
+    store.set_state(user_email, history_id, since_ts, _failed_ids(user_email, errors))
+    mark_mailbox_changed(user_email)
+
+
+def _incremental_sync(service, store, user_email, state, since_ts):
+    # messages an earlier sync couldn't download are fetched again
+    added, deleted = set(state['pending_ids']), set()
+    changed = bool(added)
+    history_id = state['history_id']
+    page_token = None
+
+    while True:
+        with timed('gmail', 'history.list'):
+            results = service.users().history().list(
+                userId='me', startHistoryId=state['history_id'],
+                historyTypes=HISTORY_TYPES, pageToken=page_token).execute()
+
+        for record in results.get('history', []):
+            for change in record.get('messagesAdded', []):
+                added.add(change['message']['id'])
+                deleted.discard(change['message']['id'])
+            for change in record.get('messagesDeleted', []):
+                deleted.add(change['message']['id'])
+                added.discard(change['message']['id'])
+            for change in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                msg = change['message']
+                labels = msg.get('labelIds', [])
+                # a message we don't have yet may have just been moved into the inbox
+                if not store.update_labels(user_email, msg['id'], labels) and 'INBOX' in labels:
+                    added.add(msg['id'])
+
+        if results.get('history'):
+            changed = True
+        history_id = results.get('historyId', history_id)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+
+    store.delete_messages(user_email, deleted)
+    errors = {}
+    for message_ids in chunked(added, BATCH_SIZE):
+        store.upsert_messages(user_email, fetch_inbox_messages(service, message_ids, errors))
+    failed = _failed_ids(user_email, errors)
+
+    # keep the store bounded as the window moves forward day by day
+    synced_since = max(state['synced_since'], since_ts - STORE_RETENTION)
+    store.prune(user_email, synced_since)
+    store.set_state(user_email, history_id, synced_since, failed)
+    if changed:
+        mark_mailbox_changed(user_email)
+    return added - failed
+
+
+def sync_mailbox(service, user_email, since_ts, store=None):
+    """
+    Brings the local message store up to date for `user_email`. The first call
+    (or a call asking for an older window than the store covers) lists and
+    downloads the whole window; after that only the changes recorded by
+    users.history.list since the stored historyId are fetched. Falls back to a
+    full resync if Gmail no longer has that history id.
+    Returns the ids of the messages an incremental sync added, or None after a full sync.
+    """
+    store = store or get_store()
+
+    with _sync_locks[user_email]:
+        state = store.get_state(user_email)
+        if state is None or state['synced_since'] > since_ts:
+            with timed('sync', 'full'):
+                _full_sync(service, store, user_email, since_ts)
+            return None
+
+        try:
+            with timed('sync', 'incremental'):
+                return _incremental_sync(service, store, user_email, state, since_ts)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print(f"History id expired for {user_email}, doing a full resync")
+            with timed('sync', 'full'):
+                _full_sync(service, store, user_email, since_ts)
+            return None
+
+
+# While a Gmail watch is live, push notifications keep the store current and
+# reads skip the sync; after this long without one they sync anyway, in case
+# a notification was lost
+PUSH_MAX_STALENESS = int(os.getenv("PUSH_MAX_STALENESS_SECONDS", "600"))
+
+
+def ensure_synced(service, user_email, since_ts, store=None):
+    """sync_mailbox, unless push ingestion has kept the store fresh enough to read as is."""
+    store = store or get_store()
+    state = store.get_state(user_email)
+    now = time.time()
+    # a watch row alone isn't enough: after a restart with push off, nothing ingests its notifications
+    if (push_active() and state is not None and state['synced_since'] <= since_ts and not state['pending_ids']
+            and store.watch_expiration(user_email) > now
+            and now - (state['synced_at'] or 0) < PUSH_MAX_STALENESS):
+        return
+    sync_mailbox(service, user_email, since_ts, store)
+
+
+# Earlier messages of a thread that go into its digest, and how much of each
+THREAD_DIGEST_MESSAGES = 5
+THREAD_DIGEST_CHARS = 200
+# partial response: just what the digest reads
+THREAD_FIELDS = 'id,messages(id,internalDate,labelIds,snippet,payload/headers)'
+
+
+def _digest_line(msg):
+    headers = msg.get('payload', {}).get('headers', [])
+    sender = 'You' if 'SENT' in msg.get('labelIds', []) else get_header(headers, 'From', 'Unknown Sender')
+    sent_at = datetime.fromtimestamp(int(msg.get('internalDate', 0)) // 1000, pytz.utc).strftime('%b %d %H:%M')
+    snippet = html.unescape(msg.get('snippet', ''))[:THREAD_DIGEST_CHARS]
+    return f"{sender} ({sent_at} UTC): {snippet}"
+
+
+def add_thread_context(service, emails):
+    """
+    Fetches each thread in `emails` once (headers and snippets only, in batch
+    requests) and gives its newest message an 'earlier_in_thread' digest of
+    the messages before it. Pre-triaged mail is skipped.
+    """
+    latest = {}
+    for email in emails:
+        thread_id = email.get('thread_id')
+        if not thread_id or email.get('triage'):
+            continue
+        if thread_id not in latest or email['internal_date'] > latest[thread_id]['internal_date']:
+            latest[thread_id] = email
+
+    for thread in hydrate_threads(service, latest, fields=THREAD_FIELDS, metadata_headers=['From']):
+        email = latest[thread['id']]
+        earlier = sorted(
+            (msg for msg in thread.get('messages', [])
+             if msg['id'] != email['id'] and int(msg.get('internalDate', 0)) // 1000 <= email['internal_date']),
+            key=lambda msg: int(msg.get('internalDate', 0)))
+        if earlier:
+            email['earlier_in_thread'] = '\n'.join(_digest_line(msg) for msg in earlier[-THREAD_DIGEST_MESSAGES:])
+    return emails
+
+
+# The dashboard asks for the count, summary and auto-respond of the same window
+# at once; they share one sync + store read, kept this long unless the mailbox changes
+WINDOW_SNAPSHOT_TTL = int(os.getenv("WINDOW_SNAPSHOT_TTL_SECONDS", "60"))
+
+snapshot_cache = TTLCache(max_size=256, ttl=WINDOW_SNAPSHOT_TTL)
+
+
+def _load_snapshot(service, user_email, since_ts):
+    # sync first, then read the window from the local store
+    ensure_synced(service, user_email, since_ts)
+    version = _mailbox_versions[user_email]
+    return version, tuple(get_store().iter_messages(user_email, since_ts))
+
+
+def window_snapshot(service, user_email, since_ts):
+    """
+    The parsed inbox messages received since `since_ts`, newest first. Callers
+    asking for the same window at the same time wait for a single load, and
+    the result is reused for WINDOW_SNAPSHOT_TTL or until a sync changes the
+    mailbox. The dicts are shared: copy them before modifying.
+    """
+    key = (user_email, since_ts)
+    load = lambda: _load_snapshot(service, user_email, since_ts)
+    version, emails = snapshot_cache.get_or_load(key, load)
+    if version != _mailbox_versions[user_email]:
+        snapshot_cache.invalidate(key)
+        version, emails = snapshot_cache.get_or_load(key, load)
+    return emails
+
+
+def load_window_emails(service, user_email, timezone, since_hour, since_ts=None):
+    # since_ts pins the window start; by default it's the window open now
+    if since_ts is None:
+        since_ts = get_window_start(timezone, since_hour)
+    return [dict(email) for email in window_snapshot(service, user_email, since_ts)]
+
+
+def collect_summary_input(service, user_email, timezone, since_hour, since_ts=None):
+    try:
+        emails = trim_emails([{
+            'id': msg['id'],
+            'from': msg['from'],
+            'subject': msg['subject'],
+            'body': msg['body']
+        } for msg in load_window_emails(service, user_email, timezone, since_hour, since_ts)], 'summary')
+        # one entry per group of near-identical emails, with how many it stands for
+        return [{
+            'from': rep['from'],
+            'subject': rep['subject'],
+            'body': rep['body'],
+            **({'count': rep['count']} if rep['count'] > 1 else {}),
+        } for rep in collapse_near_duplicates(emails)]
     except Exception as e:
         print("Error in fetching emails:", repr(e))
         raise
 
-    emails_data = []
-
-    for msg in messages:
-        msg_data = service.users().messages().get(
-            userId='me', id=msg['id'], format='full').execute()
-        headers = msg_data['payload'].get('headers', [])
-        subject = next((h['value']
-                       for h in headers if h['name'] == 'Subject'), 'No Subject')
-        sender = next((h['value'] for h in headers if h['name']
-                      == 'From'), 'Unknown Sender')
-        body = get_body_from_payload(msg_data['payload'])
 
-        emails_data.append({
-            'from': sender,
-            'subject': subject,
-            'body': body
-        })
-
-        # print(f"{sender} \n {body} \n\n")
+def fetch_todays_emails_and_summarize(service, user_email, timezone, since_hour):
+    emails_data = collect_summary_input(service, user_email, timezone, since_hour)
 
     if emails_data:
         summary = generate_summary(emails_data)
@@ -161,28 +481,88 @@ def fetch_todays_emails_and_summarize(service, timezone, since_hour):
 
 
 def email_summarizer(user_email, timezone, since_hour):
-    creds = get_credentials(user_email)
-    service = build('gmail', 'v1', credentials=creds)
-    summary = fetch_todays_emails_and_summarize(service, timezone, since_hour)
+    service = get_gmail_service(user_email)
+    summary = fetch_todays_emails_and_summarize(
+        service, user_email, timezone, since_hour)
     return summary
 
 
-def create_message(sender, to, subject, message_text):
-    """Create a MIMEText email and encode it in base64 for Gmail API."""
+# How old a precomputed (scheduled) summary may be and still be served
+PRECOMPUTED_SUMMARY_MAX_AGE = int(os.getenv("PRECOMPUTED_SUMMARY_MAX_AGE", "1800"))
+
+
+async def aemail_summarizer(user_email, timezone, since_hour, progress=None, on_event=None):
+    # Serve the summary the daily scheduler computed for this window, if it's recent
+    window_start = get_window_start(timezone, since_hour)
+    found, summary = await asyncio.to_thread(
+        get_store().get_summary, user_email, window_start, PRECOMPUTED_SUMMARY_MAX_AGE)
+    if found:
+        return summary
+
+    return await asummarize_window(user_email, timezone, since_hour, progress, on_event)
+
+
+async def aprecompute_summary(user_email, timezone, since_hour, due=None):
+    """
+    Runs the summary pipeline now and stores the result for aemail_summarizer to
+    serve. Scheduled runs happen shortly before `due`, so the window summarized
+    (and stored) is the one a request will ask for at `due`, not the one open
+    now. If that window hasn't opened yet (summary_hour == since_hour), there is
+    nothing to precompute and None is returned.
+    """
+    window_start = get_window_start(timezone, since_hour, now=due)
+    if window_start > time.time():
+        print(f"Skipping summary precompute for {user_email}: its window opens at the due time")
+        return None
+    summary = await asummarize_window(user_email, timezone, since_hour, since_ts=window_start)
+    await asyncio.to_thread(get_store().save_summary, user_email, window_start, summary)
+    return summary
+
+
+async def asummarize_window(user_email, timezone, since_hour, progress=None, on_event=None, since_ts=None):
+    # Gmail and the local store are blocking, so they run on the I/O thread pool;
+    # the Gemini call is awaited directly.
+    progress = progress or (lambda stage: None)
+
+    progress("fetching emails")
+    with timed('pipeline', 'summary_fetch'):
+        service = await asyncio.to_thread(get_gmail_service, user_email)
+        emails_data = await asyncio.to_thread(
+            collect_summary_input, service, user_email, timezone, since_hour, since_ts)
+
+    if emails_data:
+        progress(f"summarizing {len(emails_data)} emails")
+        with timed('pipeline', 'summary_llm'):
+            return await agenerate_summary(emails_data, on_event)
+    print("No emails found for today.")
+
+
+def create_message(sender, to, subject, message_text, in_reply_to=None, references=None, thread_id=None):
+    """
+    Create a MIMEText email and encode it in base64 for Gmail API.
+    Replies pass the original's Message-ID as `in_reply_to`, its References
+    chain and its Gmail thread id, so they thread for both Gmail and the recipient.
+    """
     message = MIMEText(message_text)
     message['to'] = to
     message['from'] = sender
     message['subject'] = subject
+    if in_reply_to:
+        message['In-Reply-To'] = in_reply_to
+    if references:
+        message['References'] = references
 
     raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    return {'raw': raw}
+    body = {'raw': raw}
+    if thread_id:
+        body['threadId'] = thread_id
+    return body
 
 
 def send_message(sender: str, to: str, subject: str, message_text: str):
     """Use Gmail API to send an email using user credentials."""
     try:
-        creds = get_credentials(sender)
-        service = build('gmail', 'v1', credentials=creds)
+        service = get_gmail_service(sender)
         message = create_message(sender, to, subject, message_text)
         sent_msg = service.users().messages().send(userId="me", body=message).execute()
         print(f"✅ Message sent! ID: {sent_msg['id']}")
@@ -191,3 +571,75 @@ def send_message(sender: str, to: str, subject: str, message_text: str):
     except Exception as e:
         print(f"❌ Error sending email: {e}")
         return None
+
+
+async def asend_message(sender: str, to: str, subject: str, message_text: str):
+    return await asyncio.to_thread(send_message, sender, to, subject, message_text)
+
+
+# Headers of the original message a reply needs
+REPLY_HEADERS = ['Message-ID', 'References', 'Subject', 'From', 'Reply-To']
+REPLY_FIELDS = 'id,threadId,payload/headers'
+
+
+def create_reply(sender, original, message_text, to=None, subject=None):
+    """A create_message() body replying to `original` (a metadata message with REPLY_HEADERS)."""
+    headers = original['payload'].get('headers', [])
+    message_id = get_header(headers, 'Message-ID')
+    references = ' '.join(filter(None, [get_header(headers, 'References'), message_id]))
+    if not subject:
+        subject = get_header(headers, 'Subject', '')
+        if not subject.lower().startswith('re:'):
+            subject = f"Re: {subject}"
+    to = to or get_header(headers, 'Reply-To') or get_header(headers, 'From')
+    return create_message(sender, to, subject, message_text, message_id, references or None, original['threadId'])
+
+
+def send_messages(sender, drafts):
+    """
+    Sends a list of drafts for one user ({'message', and 'to' / 'subject' /
+    'reply_to_id'}). A draft with a 'reply_to_id' is sent as a threaded reply
+    to that Gmail message, to its sender unless 'to' is given. Everything goes
+    out in batch requests on the user's cached connection; only sends Gmail
+    rejected as rate limited are retried, since a send that hit a 5xx may
+    already have been delivered.
+    Returns one {'status', 'message_id', 'thread_id', 'error'} per draft, in order.
+    """
+    service = get_gmail_service(sender)
+    reply_ids = {draft['reply_to_id'] for draft in drafts if draft.get('reply_to_id')}
+    originals = {msg['id']: msg for msg in hydrate_messages(
+        service, reply_ids, format='metadata', metadata_headers=REPLY_HEADERS, fields=REPLY_FIELDS)}
+
+    results = [None] * len(drafts)
+    bodies = {}
+    for i, draft in enumerate(drafts):
+        reply_to = draft.get('reply_to_id')
+        if reply_to and reply_to not in originals:
+            results[i] = {'status': 'failed', 'error': f"Message {reply_to} to reply to was not found"}
+        elif reply_to:
+            bodies[str(i)] = create_reply(sender, originals[reply_to], draft['message'],
+                                          draft.get('to'), draft.get('subject'))
+        elif not draft.get('to'):
+            results[i] = {'status': 'failed', 'error': "A recipient is required unless replying"}
+        else:
+            bodies[str(i)] = create_message(sender, draft['to'], draft.get('subject') or '', draft['message'])
+
+    errors = {}
+    sent = send_batch(service, bodies, errors=errors)
+    for key in bodies:
+        if key in sent:
+            results[int(key)] = {'status': 'sent', 'message_id': sent[key]['id'],
+                                 'thread_id': sent[key].get('threadId')}
+        else:
+            error = errors.get(key, 'Not sent')
+            if isinstance(error, HttpError) and error.resp.status >= 500:
+                error = f"Gmail failed mid-send ({error.resp.status}); check the Sent folder before resubmitting"
+            results[int(key)] = {'status': 'failed', 'error': str(error)}
+
+    print(f"Sent {sum(result['status'] == 'sent' for result in results)} of {len(drafts)} emails for {sender}")
+    return [{'status': result['status'], 'message_id': result.get('message_id'),
+             'thread_id': result.get('thread_id'), 'error': result.get('error')} for result in results]
+
+
+async def asend_messages(sender, drafts):
+    return await asyncio.to_thread(send_messages, sender, drafts)
@@ -1,8 +1,15 @@
+import asyncio
+import json
+
 from google import genai
 from dotenv import load_dotenv
 import os
 from pydantic import BaseModel
 
+from llm_batching import JsonArrayStream, acall_json, chunk_by_tokens, gather_limited
+from llm_cache import cache_key, llm_cache
+from rate_limit import estimate_tokens
+
 load_dotenv()
 
 API_KEY = os.getenv("API_KEY")
@@ -48,8 +55,16 @@ def generate_reply(sender, subject, snippet, body):
     print(res.text)
 
 
-def generate_summary(EMAILS):
-    prompt = f"""You are a smart, friendly and polite email assistant. You are being given a list of emails, in a JSON format with 3 fields for each email - 'from', 'subject' and 'body'.
+SUMMARY_MODEL = "gemini-2.0-flash"
+SUMMARY_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": list[Summary],
+}
+
+
+def build_summary_prompt(EMAILS):
+    return f"""You are a smart, friendly and polite email assistant. You are being given a list of emails, in a JSON format with 3 fields for each email - 'from', 'subject' and 'body'.
+    Some emails also have a 'count' field: that email stands for that many near-identical emails (e.g. repeated notifications), so summarize them together in one sentence and say how many there were.
     Analyze all the given emails carefully and generate a clear, concise and to-the-point summary for all these emails. Avoid jargon and use simple, human language.
     You should include ALL THE IMPORTANT and urgent points in the summary, while promotional emails could be given less importance.
     You can mention the senders for the important emails if required as well.
@@ -90,10 +105,91 @@ def generate_summary(EMAILS):
     ---
     """
 
-    res = client.models.generate_content(
-        model="gemini-2.0-flash", contents=prompt, config={
-            "response_mime_type": "application/json",
-            "response_schema": list[Summary],
-        })
 
-    return res.text
+def merge_summaries(parts):
+    """
+    Reduce step: merges per-chunk summaries into one object per category,
+    keeping categories in the order they first appear.
+    """
+    merged = {}
+    for part in parts:
+        for obj in part:
+            merged.setdefault(obj['category'].strip(), []).extend(obj['points'])
+    return [{"category": category, "points": points} for category, points in merged.items()]
+
+
+def _check_summary(parsed):
+    for obj in parsed:
+        if not isinstance(obj['category'], str) or not isinstance(obj['points'], list):
+            raise ValueError("summary objects need a 'category' string and a 'points' list")
+
+
+async def _stream_summary(prompt, on_category):
+    # hands each category object over as soon as the model has finished writing it
+    parser = JsonArrayStream()
+    text = []
+    stream = await client.aio.models.generate_content_stream(
+        model=SUMMARY_MODEL, contents=prompt, config=SUMMARY_CONFIG)
+    async for piece in stream:
+        if piece.text:
+            text.append(piece.text)
+            for obj in parser.feed(piece.text):
+                if isinstance(obj, dict) and 'category' in obj and 'points' in obj:
+                    on_category(obj)
+    return ''.join(text)
+
+
+async def _summarize_chunk(emails, on_category=None):
+    # the same set of emails under the same prompt and model is summarized once
+    key = cache_key('summary', emails, build_summary_prompt(''), SUMMARY_MODEL)
+    summary = await llm_cache.aget(key)
+    streaming = False
+    if summary is None:
+        prompt = build_summary_prompt(emails)
+        # stream the reply when someone is listening and the client supports it
+        streaming = on_category is not None and hasattr(client.aio.models, 'generate_content_stream')
+        if streaming:
+            emitted = []
+
+            def emit_new(obj):
+                # a retried call (bad JSON, 429 mid-stream) streams the same categories again
+                if obj not in emitted:
+                    emitted.append(obj)
+                    on_category(obj)
+
+            def call():
+                return _stream_summary(prompt, emit_new)
+        else:
+            def call():
+                return client.aio.models.generate_content(model=SUMMARY_MODEL, contents=prompt, config=SUMMARY_CONFIG)
+
+        # waits for Gemini quota (and retries on 429s) instead of failing the request
+        summary = await acall_json(call, estimate_tokens(prompt), validate=_check_summary, label="summary")
+        if summary is not None:
+            await llm_cache.aset(key, summary)
+
+    if on_category and summary is not None and not streaming:
+        for obj in summary:
+            on_category(obj)
+    return summary
+
+
+def generate_summary(EMAILS):
+    """Synchronous wrapper around agenerate_summary, for callers without an event loop."""
+    return asyncio.run(agenerate_summary(EMAILS))
+
+
+async def agenerate_summary(EMAILS, on_event=None):
+    # map: summarize token-budgeted chunks in parallel; reduce: merge their categories.
+    # on_event(event, data) gets a "summary_category" event per category of each
+    # chunk as it is generated; the merged result is the return value.
+    on_category = (lambda obj: on_event("summary_category", obj)) if on_event else None
+    chunks = chunk_by_tokens(EMAILS)
+    parts = await gather_limited([_summarize_chunk(chunk, on_category) for chunk in chunks])
+    failed = sum(part is None for part in parts)
+    if failed == len(chunks):
+        raise ValueError("Gemini returned no usable summary")
+    if failed:
+        print(f"{failed} of {len(chunks)} summary chunks failed; summarizing the rest")
+
+    return json.dumps(merge_summaries(part for part in parts if part))
@@ -1,10 +1,13 @@
 import os
+from datetime import datetime, timedelta, timezone
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import json
 
+from metrics import timed
+
 load_dotenv()
 # Your env values
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -13,16 +16,40 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
+# Refresh tokens this long before they actually expire
+REFRESH_SKEW = timedelta(minutes=5)
+
+
+def parse_expiry(expires_at):
+    # google-auth wants a naive UTC datetime
+    if not expires_at:
+        return None
+    expiry = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+    if expiry.tzinfo is not None:
+        expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+    return expiry
+
+
+def format_expiry(expiry):
+    return expiry.replace(tzinfo=timezone.utc).isoformat() if expiry else None
+
+
+def expires_soon(creds, skew=REFRESH_SKEW):
+    if creds.expiry is None:
+        return False
+    return creds.expiry - skew <= datetime.now(timezone.utc).replace(tzinfo=None)
+
 
 def get_credentials(user_email: str) -> Credentials:
     # Fetch token data from Supabase
-    response = (
-        supabase.table("gmail_tokens")
-        .select('*')
-        .eq('user_id', user_email)
-        .single()
-        .execute()
-    )
+    with timed('credentials', 'supabase_fetch'):
+        response = (
+            supabase.table("gmail_tokens")
+            .select('*')
+            .eq('user_id', user_email)
+            .single()
+            .execute()
+        )
 
     try:
         # if response.error:
@@ -40,23 +67,25 @@ def get_credentials(user_email: str) -> Credentials:
             token_uri='https://oauth2.googleapis.com/token',
             client_id=os.getenv('GOOGLE_CLIENT_ID'),
             client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
-            scopes=SCOPES
+            scopes=SCOPES,
+            expiry=parse_expiry(token_data.get('expires_at')),
         )
 
     except Exception as e:
         print("In get_creds.py, Error creating credentials:", repr(e))
         raise
 
-    # Refresh if expired
-    if not creds.valid:
-        if creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+    # Refresh if expired (or about to be)
+    if not creds.valid or expires_soon(creds):
+        if creds.refresh_token:
+            with timed('credentials', 'oauth_refresh'):
+                creds.refresh(Request())
 
             # Optionally update the new access_token and expiry in Supabase
             supabase.from_('gmail_tokens').update({
                 'access_token': creds.token,
-                'expires_at': creds.expiry.isoformat() if creds.expiry else None
-            }).eq('user_email', user_email).execute()
+                'expires_at': format_expiry(creds.expiry)
+            }).eq('user_id', user_email).execute()
         else:
             raise Exception(
                 "get_cred.py: No valid credentials or refresh token.")
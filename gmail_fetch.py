@@ -0,0 +1,331 @@
+import json
+import queue
+import threading
+import time
+from itertools import islice
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient.errors import HttpError
+
+from metrics import timed
+from rate_limit import MAX_RATE_LIMIT_RETRIES, gmail_limiter, gmail_request_cost, gmail_retry_after
+
+# Gmail accepts up to 100 calls per batch, but recommends staying at 50 or below
+# since larger batches tend to trip the per-user concurrency limit.
+BATCH_SIZE = 50
+# messages.list returns at most 500 ids per page
+PAGE_SIZE = 500
+MAX_BATCH_RETRIES = 3
+# messages.send costs 100 quota units (20x a get), so sends go out in smaller batches
+SEND_BATCH_SIZE = 10
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Partial-response masks (the `fields` parameter), so Gmail only sends what a stage reads
+MESSAGE_FIELDS = 'id,threadId,labelIds,internalDate,snippet'
+# pre-triage: labels and the requested headers, no part tree
+METADATA_FIELDS = f'{MESSAGE_FIELDS},sizeEstimate,payload(mimeType,headers)'
+# body data of nested parts (parts deeper than this come back whole); part
+# headers, filenames and attachment ids are left out
+_BODY_PARTS = 'parts(mimeType,body/data,parts(mimeType,body/data,parts))'
+FULL_FIELDS = f'{MESSAGE_FIELDS},payload(mimeType,headers,body/data,{_BODY_PARTS})'
+# bodies of messages whose metadata was already fetched
+BODY_FIELDS = f'id,payload(mimeType,body/data,{_BODY_PARTS})'
+RAW_FIELDS = 'id,raw'
+
+_stats = {}  # format -> {'messages', 'bytes', 'parse_seconds'}
+_stats_lock = threading.Lock()
+
+
+def _is_retryable(exception):
+    if not isinstance(exception, HttpError):
+        return False
+    return (exception.resp.status in RETRYABLE_STATUSES
+            or gmail_retry_after(exception.resp, exception.content) is not None)
+
+
+def _is_rate_limited(exception):
+    # Gmail refused the request outright, so resending can't do it twice
+    return isinstance(exception, HttpError) and gmail_retry_after(exception.resp, exception.content) is not None
+
+
+class ThreadLocalHttp:
+    """
+    Stands in for AuthorizedHttp but keeps one connection per thread, so a
+    single (cached) service object can be shared by concurrent requests.
+    Assigning new credentials makes every thread reconnect with them.
+
+    Every request is also metered against the user's and the project's Gmail
+    quota, and requests Gmail rejects as over quota are retried after backing off.
+    """
+
+    def __init__(self, credentials, user_email=None):
+        self.credentials = credentials
+        self.user_email = user_email
+        self._local = threading.local()
+
+    def _http(self):
+        local = self._local
+        if getattr(local, 'credentials', None) is not self.credentials:
+            local.http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            local.credentials = self.credentials
+        return local.http
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        cost = gmail_request_cost(uri, method, body)
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            gmail_limiter.acquire(cost, self.user_email)
+            resp, content = self._http().request(uri, method, body=body, headers=headers, **kwargs)
+            retry_after = gmail_retry_after(resp, content)
+            if retry_after is None or attempt == MAX_RATE_LIMIT_RETRIES:
+                return resp, content
+            gmail_limiter.backoff(retry_after, self.user_email)
+
+    def close(self):
+        http = getattr(self._local, 'http', None)
+        if http is not None:
+            http.close()
+
+
+def fresh_http(http):
+    # httplib2 connections are not thread-safe, so work done on another thread
+    # needs its own connection carrying the same credentials.
+    if isinstance(http, ThreadLocalHttp):
+        return http
+    if isinstance(http, google_auth_httplib2.AuthorizedHttp):
+        return google_auth_httplib2.AuthorizedHttp(http.credentials, http=httplib2.Http())
+    return httplib2.Http()
+
+
+def _batch_get(service, ids, make_request, batch_size, http, errors=None, retryable=_is_retryable):
+    """
+    Runs make_request(id) for every id in Gmail batch requests, retrying the
+    ones whose error `retryable` accepts (by default, any transient failure).
+    Returns {id: resource} for those that succeeded; if an `errors` dict is
+    given, it gets {id: exception} for the rest.
+    """
+    fetched = {}
+    pending = list(ids)
+    attempt = 0
+    user_email = getattr(service._http, 'user_email', None)
+
+    while pending:
+        retry = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                fetched[request_id] = response
+            elif retryable(exception):
+                retry[request_id] = exception
+            else:
+                print(f"Error fetching {request_id}: {exception!r}")
+                if errors is not None:
+                    errors[request_id] = exception
+
+        for start in range(0, len(pending), batch_size):
+            batch = service.new_batch_http_request(callback=callback)
+            for item_id in pending[start:start + batch_size]:
+                batch.add(make_request(item_id), request_id=item_id)
+            batch.execute(http=http)
+
+        if not retry:
+            break
+
+        attempt += 1
+        if attempt > MAX_BATCH_RETRIES:
+            print(f"Giving up on {len(retry)} items after {MAX_BATCH_RETRIES} retries")
+            if errors is not None:
+                errors.update(retry)
+            break
+
+        # back off before resending only the requests that failed, and hold
+        # back the user's other Gmail calls for as long
+        delay = 2 ** (attempt - 1)
+        gmail_limiter.backoff(delay, user_email)
+        time.sleep(delay)
+        pending = list(retry)
+
+    return fetched
+
+
+def _format_stats(format):
+    # caller holds _stats_lock
+    return _stats.setdefault(format, {'messages': 0, 'bytes': 0, 'parse_seconds': 0.0})
+
+
+def record_parse(format, seconds):
+    """Adds time spent turning fetched messages of `format` into text to fetch_stats()."""
+    with _stats_lock:
+        _format_stats(format)['parse_seconds'] += seconds
+
+
+def fetch_stats():
+    """Per message format: messages fetched, their JSON size and the time spent parsing them."""
+    with _stats_lock:
+        return {format: dict(stats,
+                             bytes_per_message=stats['bytes'] // max(stats['messages'], 1),
+                             parse_ms_per_message=round(1000 * stats['parse_seconds'] / max(stats['messages'], 1), 3))
+                for format, stats in _stats.items()}
+
+
+def hydrate_messages(service, message_ids, format='full', batch_size=BATCH_SIZE, http=None,
+                     metadata_headers=None, fields=None, errors=None):
+    """
+    Fetches many messages with Gmail batch requests instead of one
+    messages.get round trip per message.
+    Args:
+        service: An authorized Gmail API service object.
+        message_ids: Message IDs to fetch.
+        format: Gmail message format ('full', 'metadata', 'minimal' or 'raw').
+        batch_size: Number of messages per batch request (max 100).
+        http: Optional http object to send the batches on (defaults to the service's).
+        metadata_headers: With format='metadata', only return these headers.
+        fields: Optional partial-response mask, e.g. BODY_FIELDS.
+        errors: Optional dict that gets {id: exception} for the messages that failed.
+    Returns:
+        A list of message resources in the same order as message_ids. Messages
+        that could not be fetched (after retries for transient errors) are left out.
+    """
+    message_ids = list(message_ids)
+    params = {'metadataHeaders': metadata_headers} if metadata_headers else {}
+    if fields:
+        params['fields'] = fields
+    with timed('gmail', f'messages.get.{format}'):
+        fetched = _batch_get(service, message_ids, lambda msg_id: service.users().messages().get(
+            userId='me', id=msg_id, format=format, **params), batch_size, http, errors)
+    messages = [fetched[msg_id] for msg_id in message_ids if msg_id in fetched]
+
+    # compact JSON size, close to what crossed the wire before compression
+    size = sum(len(json.dumps(msg, separators=(',', ':'))) for msg in messages)
+    with _stats_lock:
+        stats = _format_stats(format)
+        stats['messages'] += len(messages)
+        stats['bytes'] += size
+    return messages
+
+
+def send_batch(service, bodies, batch_size=SEND_BATCH_SIZE, http=None, errors=None):
+    """
+    Sends {key: message body} with batched messages.send calls. Sends are
+    not idempotent, so only those Gmail rejected as rate limited are retried;
+    after a 5xx the message may already have gone out, and it is reported as
+    failed instead of being resent. Returns {key: sent message} for the ones
+    that went out; failures go into `errors` if given.
+    """
+    with timed('gmail', 'messages.send'):
+        return _batch_get(service, list(bodies), lambda key: service.users().messages().send(
+            userId='me', body=bodies[key]), batch_size, http, errors, retryable=_is_rate_limited)
+
+
+def hydrate_threads(service, thread_ids, format='metadata', fields=None, metadata_headers=None,
+                    batch_size=BATCH_SIZE, http=None):
+    """
+    Batch version of threads.get. `fields` is a partial-response mask, e.g.
+    'messages(id,snippet)', so only what the caller reads crosses the wire.
+    Returns the thread resources in the same order as thread_ids, leaving out failures.
+    """
+    thread_ids = list(thread_ids)
+    params = {'metadataHeaders': metadata_headers} if metadata_headers else {}
+    if fields:
+        params['fields'] = fields
+    with timed('gmail', 'threads.get'):
+        fetched = _batch_get(service, thread_ids, lambda thread_id: service.users().threads().get(
+            userId='me', id=thread_id, format=format, **params), batch_size, http)
+    return [fetched[thread_id] for thread_id in thread_ids if thread_id in fetched]
+
+
+def _prefetch(iterator, depth):
+    """
+    Runs `iterator` on a background thread, keeping up to `depth` items ready
+    ahead of the consumer. Exceptions raised by the iterator are re-raised in
+    the consumer, and closing the generator stops the background thread.
+    """
+    done = object()
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _iter_id_pages(service, query, page_size, http):
+    page_token = None
+    while True:
+        with timed('gmail', 'messages.list'):
+            results = service.users().messages().list(
+                userId='me', q=query, maxResults=page_size,
+                pageToken=page_token).execute(http=http)
+        yield [msg['id'] for msg in results.get('messages', [])]
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def iter_message_ids(service, query, limit=None, page_size=PAGE_SIZE, prefetch=1):
+    """
+    Yields the ids of every message matching `query`, following nextPageToken
+    until the listing is exhausted (or `limit` ids have been yielded). The next
+    page is requested in the background while the current one is consumed.
+    """
+    if limit is not None:
+        page_size = min(page_size, limit)
+    pages = _iter_id_pages(service, query, page_size, fresh_http(service._http))
+    ids = (msg_id for page in _prefetch(pages, prefetch) for msg_id in page)
+    return islice(ids, limit)
+
+
+def iter_messages(service, query, format='full', limit=None, batch_size=BATCH_SIZE, prefetch=1,
+                  metadata_headers=None, fields=None, errors=None):
+    """
+    Yields hydrated message resources for `query` as a stream. Ids are grouped
+    into batch requests and the next batch is fetched while the current one is
+    being consumed, so only a couple of batches are held in memory at a time.
+    Messages that couldn't be fetched go into `errors`, if given.
+    """
+    def batches():
+        http = fresh_http(service._http)
+        for message_ids in chunked(iter_message_ids(service, query, limit), batch_size):
+            yield hydrate_messages(service, message_ids, format, batch_size, http, metadata_headers, fields,
+                                   errors)
+
+    for batch in _prefetch(batches(), prefetch):
+        yield from batch
+
+
+def list_message_ids(service, query, max_results=None):
+    return list(iter_message_ids(service, query, max_results))
@@ -0,0 +1,83 @@
+import json
+import os
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+
+from get_creds import REFRESH_SKEW, get_credentials
+from gmail_fetch import ThreadLocalHttp
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+CACHE_MAX_USERS = int(os.getenv("GMAIL_CACHE_MAX_USERS", "1000"))
+# Used when a token has no recorded expiry
+DEFAULT_CREDENTIALS_TTL = 50 * 60
+SERVICE_TTL = 24 * 3600
+# Point the Gmail client somewhere other than Google, e.g. the local fake in benchmarks/
+GMAIL_API_ROOT = os.getenv("GMAIL_API_ROOT")
+
+# user email -> google.oauth2 Credentials, evicted shortly before the token expires
+credentials_cache = TTLCache(max_size=CACHE_MAX_USERS, ttl=DEFAULT_CREDENTIALS_TTL)
+# user email -> (ThreadLocalHttp, Gmail service); built once and reused across token refreshes
+service_cache = TTLCache(max_size=CACHE_MAX_USERS, ttl=SERVICE_TTL)
+
+
+def credentials_ttl(creds):
+    if creds.expiry is None:
+        return DEFAULT_CREDENTIALS_TTL
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (creds.expiry - REFRESH_SKEW - now).total_seconds()
+
+
+def get_cached_credentials(user_email):
+    # Concurrent misses for the same user share one Supabase read / token refresh
+    return credentials_cache.get_or_load(
+        user_email, lambda: get_credentials(user_email), ttl=credentials_ttl)
+
+
+def store_credentials(user_email, creds):
+    """Puts freshly refreshed credentials in the cache (e.g. from the token refresher)."""
+    credentials_cache.set(user_email, creds, credentials_ttl(creds))
+
+
+def _build_service(user_email, creds):
+    http = ThreadLocalHttp(creds, user_email)
+    if GMAIL_API_ROOT:
+        # rewrite rootUrl rather than using client_options, so batch requests follow too
+        document = json.loads(discovery_cache.get_static_doc('gmail', 'v1'))
+        document['rootUrl'] = GMAIL_API_ROOT
+        return http, build_from_document(document, http=http)
+    return http, build('gmail', 'v1', http=http, cache_discovery=False)
+
+
+def get_gmail_service(user_email):
+    """
+    Returns a Gmail service for `user_email`, reusing the discovery-built
+    service object and the user's credentials across requests.
+    """
+    try:
+        creds = get_cached_credentials(user_email)
+    except Exception:
+        # e.g. a revoked grant: drop the user's cached connection along with the dead token
+        invalidate_user(user_email)
+        raise
+    http, service = service_cache.get_or_load(user_email, lambda: _build_service(user_email, creds))
+    # the service outlives individual tokens, so point it at the current ones
+    http.credentials = creds
+    return service
+
+
+def invalidate_user(user_email):
+    """Forgets the user's cached credentials and Gmail service."""
+    credentials_cache.invalidate(user_email)
+    service_cache.invalidate(user_email)
+
+
+def cache_stats():
+    return {
+        'credentials': credentials_cache.stats(),
+        'services': service_cache.stats(),
+    }
@@ -0,0 +1,119 @@
+import os
+import re
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Stop extracting once this much text has been collected; nobody reads past it
+HTML_TEXT_MAX_CHARS = int(os.getenv("HTML_TEXT_MAX_CHARS", "20000"))
+# HTML is fed to the parser in slices this big, so a long email can stop early
+FEED_SIZE = 16 * 1024
+
+SKIP_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template', 'svg'}
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li',
+    'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'tr', 'ul',
+}
+CELL_TAGS = {'td', 'th'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+             'meta', 'param', 'source', 'track', 'wbr'}
+_HIDDEN_STYLE = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden', re.IGNORECASE)
+
+
+def _is_hidden(attrs):
+    for name, value in attrs:
+        if name == 'hidden' or (name == 'style' and value and _HIDDEN_STYLE.search(value)):
+            return True
+    return False
+
+
+class _TextExtractor(HTMLParser):
+    """Collects visible text, skipping script/style/hidden elements, until `max_chars` is reached."""
+
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.pieces = []
+        self.size = 0
+        self.skip_tag = None
+        self.skip_depth = 0
+
+    @property
+    def full(self):
+        return self.size >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_tag is not None:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+            return
+        if tag in SKIP_TAGS or (tag not in VOID_TAGS and _is_hidden(attrs)):
+            self.skip_tag, self.skip_depth = tag, 1
+            return
+        if tag in BLOCK_TAGS:
+            self.pieces.append('\n')
+        elif tag in CELL_TAGS:
+            self.pieces.append(' ')
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/> and friends: never opens a skipped block
+        if self.skip_tag is None and tag in BLOCK_TAGS:
+            self.pieces.append('\n')
+
+    def handle_endtag(self, tag):
+        if self.skip_tag is not None:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if self.skip_depth == 0:
+                    self.skip_tag = None
+            return
+        if tag in BLOCK_TAGS:
+            self.pieces.append('\n')
+
+    def handle_data(self, data):
+        if self.skip_tag is None and not self.full:
+            self.pieces.append(data)
+            self.size += len(data)
+
+    def text(self):
+        lines = (' '.join(line.split()) for line in ''.join(self.pieces).splitlines())
+        return '\n'.join(line for line in lines if line)[:self.max_chars]
+
+
+def extract_text_bs4(html_content, max_chars=None):
+    """The original BeautifulSoup extraction; used when the streaming parser gives up."""
+    soup = BeautifulSoup(html_content, "html.parser")
+    text = soup.get_text(separator="\n").strip()
+    lines = text.splitlines()
+    # remove excess blank lines from text, just to keep it clean
+    clean_lines = [line.strip() for line in lines if line.strip()]
+    return "\n".join(clean_lines)[:max_chars]
+
+
+def html_to_text(html_content, max_chars=HTML_TEXT_MAX_CHARS):
+    """
+    Streams `html_content` through a lightweight parser and returns its visible
+    text, one block per line, stopping once `max_chars` characters are collected.
+    Falls back to BeautifulSoup if the markup trips up the parser.
+    """
+    parser = _TextExtractor(max_chars)
+    try:
+        for start in range(0, len(html_content), FEED_SIZE):
+            parser.feed(html_content[start:start + FEED_SIZE])
+            if parser.full:
+                break
+        else:
+            parser.close()
+        text = parser.text()
+    except Exception as e:
+        print(f"HTML parser failed, falling back to BeautifulSoup: {e!r}")
+        return extract_text_bs4(html_content, max_chars)
+
+    # an unclosed hidden/skipped element can swallow the whole body
+    if not text and parser.skip_tag is not None:
+        return extract_text_bs4(html_content, max_chars)
+    return text
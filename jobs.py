@@ -0,0 +1,157 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# Finished jobs are kept this long so clients can still poll their result
+JOB_RETENTION = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+
+class JobBackend(ABC):
+    """Where job state lives. Implement this for a persistent store (e.g. Supabase or Redis)."""
+
+    @abstractmethod
+    def create(self, job: dict) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> None:
+        ...
+
+    @abstractmethod
+    def find_active(self, dedup_key: str) -> dict | None:
+        """Returns a queued or running job with this dedup key, if there is one."""
+
+
+class InMemoryJobBackend(JobBackend):
+    def __init__(self, retention=JOB_RETENTION):
+        self.retention = retention
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def _prune(self):
+        # caller holds self.lock
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job['status'] not in ACTIVE and job['updated_at'] < cutoff]:
+            del self.jobs[job_id]
+
+    def create(self, job):
+        with self.lock:
+            self._prune()
+            self.jobs[job['id']] = dict(job)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields, updated_at=time.time())
+
+    def find_active(self, dedup_key):
+        with self.lock:
+            for job in self.jobs.values():
+                if job['dedup_key'] == dedup_key and job['status'] in ACTIVE:
+                    return dict(job)
+        return None
+
+
+class JobManager:
+    """
+    Runs pipeline calls in the background on a bounded pool of asyncio workers.
+    `handlers` maps a job kind to an async function taking
+    (user_email, timezone, since_hour, progress=callback).
+    """
+
+    def __init__(self, handlers, backend=None, workers=JOB_WORKERS):
+        self.handlers = handlers
+        self.backend = backend or InMemoryJobBackend()
+        self.workers = workers
+        self.queue = None
+        self.tasks = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, kind, user_email, timezone, since_hour, window_key):
+        """
+        Queues a job and returns it, or returns the already queued/running job
+        for the same user, kind and window instead of starting a duplicate.
+        """
+        dedup_key = f"{kind}:{user_email}:{window_key}"
+        with self.lock:
+            existing = self.backend.find_active(dedup_key)
+            if existing:
+                return existing
+
+            now = time.time()
+            job = {
+                'id': uuid.uuid4().hex,
+                'kind': kind,
+                'dedup_key': dedup_key,
+                'user_email': user_email,
+                'timezone': timezone,
+                'since_hour': since_hour,
+                'status': QUEUED,
+                'progress': QUEUED,
+                'result': None,
+                'error': None,
+                'created_at': now,
+                'updated_at': now,
+            }
+            self.backend.create(job)
+
+        self.queue.put_nowait(job['id'])
+        return job
+
+    def get(self, job_id):
+        return self.backend.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id):
+        job = self.backend.get(job_id)
+        if job is None:
+            return
+
+        def progress(stage):
+            self.backend.update(job_id, progress=stage)
+
+        self.backend.update(job_id, status=RUNNING, progress=RUNNING)
+        try:
+            result = await self.handlers[job['kind']](
+                job['user_email'], job['timezone'], job['since_hour'], progress=progress)
+            self.backend.update(job_id, status=DONE, progress=DONE, result=result)
+        except Exception as e:
+            print(f"Job {job_id} ({job['kind']}) failed: {e!r}")
+            self.backend.update(job_id, status=FAILED, progress=FAILED, error=str(e))
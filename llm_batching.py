@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+
+from dotenv import load_dotenv
+
+from metrics import llm_json_failures, llm_tokens, timed
+from rate_limit import acall_gemini, estimate_tokens
+
+load_dotenv()
+
+# Estimated prompt tokens per chunk of emails; each chunk is one LLM call
+LLM_CHUNK_TOKENS = int(os.getenv("LLM_CHUNK_TOKENS", "8000"))
+# Chunk calls in flight at once for a single request
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+# Extra attempts for a chunk whose reply is not the JSON we asked for
+CHUNK_RETRIES = 2
+
+
+def chunk_by_tokens(items, budget=LLM_CHUNK_TOKENS):
+    """
+    Splits `items` into consecutive lists whose JSON stays within `budget`
+    estimated tokens. An item bigger than the budget gets a chunk of its own.
+    """
+    chunks, current, used = [], [], 0
+    for item in items:
+        size = estimate_tokens(json.dumps(item))
+        if current and used + size > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def parse_json_output(raw):
+    """Parses a model reply as JSON, tolerating a ```json code fence around it."""
+    # .text is None when the model returned no text part (e.g. a blocked reply)
+    if not raw:
+        raise ValueError("empty model reply")
+    cleaned = raw.strip()
+    if cleaned.startswith("```json") and cleaned.endswith("```"):
+        cleaned = cleaned[len("```json"):-len("```")].strip()
+    return json.loads(cleaned)
+
+
+class JsonArrayStream:
+    """
+    Incremental parser for a streamed JSON array: feed() it text as it arrives
+    and it returns the array elements that have become complete.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = None
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        self.buffer += text
+        items = []
+        if self.pos is None:
+            start = self.buffer.find('[')
+            if start < 0:
+                return items
+            self.pos = start + 1
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n,':
+                self.pos += 1
+            if self.pos >= len(self.buffer) or self.buffer[self.pos] == ']':
+                return items
+            try:
+                item, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # the next element hasn't fully arrived yet
+                return items
+            items.append(item)
+
+
+async def acall_json(fn, prompt_tokens, validate=None, label="LLM"):
+    """
+    Calls `fn()` through acall_gemini and parses its reply as JSON (`fn` may
+    return a string or a response with `.text`). Malformed replies are retried
+    up to CHUNK_RETRIES times; returns None if none of them parse.
+    `validate(parsed)` may raise to reject a reply that parsed but has the wrong shape.
+    """
+    for attempt in range(CHUNK_RETRIES + 1):
+        with timed('llm', label):
+            raw = await acall_gemini(fn, prompt_tokens)
+        text = getattr(raw, 'text', raw)
+        llm_tokens.inc(prompt_tokens, call=label, direction='prompt')
+        llm_tokens.inc(estimate_tokens(text or ''), call=label, direction='response')
+        try:
+            parsed = parse_json_output(text)
+            if validate:
+                validate(parsed)
+            return parsed
+        except (ValueError, KeyError, TypeError) as e:
+            llm_json_failures.inc(call=label)
+            print(f"Error decoding {label} JSON (attempt {attempt + 1}): {text} \n{repr(e)}")
+    return None
+
+
+async def gather_limited(coros, limit=LLM_CONCURRENCY):
+    """asyncio.gather with at most `limit` of the coroutines running at once."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Optional SQLite file that keeps results across restarts; unset = memory only
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+
+DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key        TEXT PRIMARY KEY,
+    value      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def normalize_text(text):
+    # whitespace-only differences shouldn't cost another model call
+    return ' '.join((text or '').split())
+
+
+def content_hash(*parts):
+    """Hash of the normalized text of `parts` (strings or JSON-serialisable values)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, str):
+            part = json.dumps(part, sort_keys=True)
+        digest.update(normalize_text(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def cache_key(kind, content, prompt, model, message_id=''):
+    """
+    Key for one LLM result: what it is (`kind`), the message it is for, a hash
+    of the content sent, and the prompt template and model that produced it.
+    Changing the prompt or model therefore never serves a stale result.
+    """
+    return f"{kind}:{message_id}:{content_hash(content, prompt, model)}"
+
+
+class _DiskTier:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(DISK_SCHEMA)
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None, 0
+        return json.loads(row[0]), row[1] - time.time()
+
+    def set(self, key, value, ttl):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl))
+
+    def prune(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+
+
+class LLMCache:
+    """
+    Two-tier cache of LLM results: an in-process LRU/TTL cache in front of an
+    optional SQLite file. Values must be JSON-serialisable. The disk tier's
+    SQLite I/O runs on a worker thread, off the event loop.
+    """
+
+    def __init__(self, max_size=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL, path=LLM_CACHE_PATH):
+        self.ttl = ttl
+        self.memory = TTLCache(max_size=max_size, ttl=ttl)
+        self.disk = _DiskTier(path) if path else None
+        self.disk_hits = 0
+        if self.disk:
+            self.disk.prune()
+
+    async def aget(self, key):
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        value, remaining = await asyncio.to_thread(self.disk.get, key)
+        if value is not None:
+            self.disk_hits += 1
+            self.memory.set(key, value, remaining)
+        return value
+
+    async def aset(self, key, value):
+        self.memory.set(key, value)
+        if self.disk:
+            await asyncio.to_thread(self.disk.set, key, value, self.ttl)
+
+    def stats(self):
+        return dict(self.memory.stats(), disk_hits=self.disk_hits, disk=self.disk is not None)
+
+
+llm_cache = LLMCache()
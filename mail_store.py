@@ -0,0 +1,207 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STORE_PATH = os.getenv("MAILBAE_STORE_PATH", "mailbae.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    user_email    TEXT NOT NULL,
+    id            TEXT NOT NULL,
+    thread_id     TEXT,
+    internal_date INTEGER NOT NULL,
+    sender        TEXT,
+    subject       TEXT,
+    body          TEXT,
+    labels        TEXT NOT NULL,
+    in_inbox      INTEGER NOT NULL,
+    triage        TEXT,
+    PRIMARY KEY (user_email, id)
+);
+CREATE INDEX IF NOT EXISTS messages_by_date ON messages (user_email, internal_date);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    user_email   TEXT NOT NULL,
+    window_start INTEGER NOT NULL,
+    summary      TEXT,
+    computed_at  REAL NOT NULL,
+    PRIMARY KEY (user_email, window_start)
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_email   TEXT PRIMARY KEY,
+    history_id   TEXT NOT NULL,
+    synced_since INTEGER NOT NULL,
+    synced_at    REAL,
+    pending_ids  TEXT
+);
+
+CREATE TABLE IF NOT EXISTS watches (
+    user_email TEXT PRIMARY KEY,
+    expiration REAL NOT NULL
+);
+"""
+
+
+def _message_from_row(row):
+    return {
+        'id': row['id'],
+        'thread_id': row['thread_id'],
+        'internal_date': row['internal_date'],
+        'from': row['sender'],
+        'subject': row['subject'],
+        'body': row['body'],
+        'labels': json.loads(row['labels']),
+        'triage': row['triage'],
+    }
+
+
+def _in_inbox(labels):
+    # mirrors the "in:inbox -in:sent" part of build_gmail_query
+    return int('INBOX' in labels and 'SENT' not in labels)
+
+
+class MailStore:
+    """
+    Local SQLite copy of each user's parsed messages, plus the Gmail historyId
+    the copy is current as of. `synced_since` is the earliest timestamp (epoch
+    seconds) the stored copy is complete for.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            # stores created by older versions lack the newer columns
+            for table, column, kind in (('messages', 'triage', 'TEXT'), ('sync_state', 'synced_at', 'REAL'),
+                                        ('sync_state', 'pending_ids', 'TEXT')):
+                columns = {row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+    def get_state(self, user_email):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT history_id, synced_since, synced_at, pending_ids FROM sync_state WHERE user_email = ?",
+                (user_email,)).fetchone()
+        if row is None:
+            return None
+        return dict(row, pending_ids=json.loads(row['pending_ids'] or '[]'))
+
+    def set_state(self, user_email, history_id, synced_since, pending_ids=()):
+        """`pending_ids` are messages the sync couldn't download; the next sync fetches them again."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (user_email, history_id, synced_since, synced_at, pending_ids) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_email, str(history_id), synced_since, time.time(), json.dumps(sorted(pending_ids))))
+
+    def upsert_messages(self, user_email, messages):
+        rows = [(
+            user_email, msg['id'], msg.get('thread_id'), msg['internal_date'],
+            msg['from'], msg['subject'], msg['body'],
+            json.dumps(msg['labels']), _in_inbox(msg['labels']), msg.get('triage'),
+        ) for msg in messages]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO messages (user_email, id, thread_id, internal_date, "
+                "sender, subject, body, labels, in_inbox, triage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+
+    def update_labels(self, user_email, msg_id, labels):
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "UPDATE messages SET labels = ?, in_inbox = ? WHERE user_email = ? AND id = ?",
+                (json.dumps(labels), _in_inbox(labels), user_email, msg_id))
+        return cursor.rowcount > 0
+
+    def delete_messages(self, user_email, msg_ids):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM messages WHERE user_email = ? AND id = ?",
+                [(user_email, msg_id) for msg_id in msg_ids])
+
+    def prune(self, user_email, older_than):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM messages WHERE user_email = ? AND internal_date < ?",
+                (user_email, older_than))
+
+    def clear_user(self, user_email):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM messages WHERE user_email = ?", (user_email,))
+            self.conn.execute("DELETE FROM sync_state WHERE user_email = ?", (user_email,))
+
+    def iter_messages(self, user_email, since_ts):
+        """Yields the stored inbox messages received since `since_ts`, newest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, thread_id, internal_date, sender, subject, body, labels, triage FROM messages "
+                "WHERE user_email = ? AND in_inbox = 1 AND internal_date >= ? "
+                "ORDER BY internal_date DESC",
+                (user_email, since_ts)).fetchall()
+        for row in rows:
+            yield _message_from_row(row)
+
+    def get_messages(self, user_email, msg_ids):
+        """Returns the stored messages with these ids (those still in the inbox), newest first."""
+        msg_ids = list(msg_ids)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, thread_id, internal_date, sender, subject, body, labels, triage FROM messages "
+                f"WHERE user_email = ? AND in_inbox = 1 AND id IN ({','.join('?' * len(msg_ids))}) "
+                "ORDER BY internal_date DESC",
+                (user_email, *msg_ids)).fetchall()
+        return [_message_from_row(row) for row in rows]
+
+    def set_watch(self, user_email, expiration):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watches (user_email, expiration) VALUES (?, ?)",
+                (user_email, expiration))
+
+    def watch_expiration(self, user_email):
+        """Epoch seconds the user's Gmail watch runs until (0 if there is none)."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT expiration FROM watches WHERE user_email = ?", (user_email,)).fetchone()
+        return row['expiration'] if row else 0
+
+    def save_summary(self, user_email, window_start, summary):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO summaries (user_email, window_start, summary, computed_at) "
+                "VALUES (?, ?, ?, ?)", (user_email, window_start, summary, time.time()))
+            # only the latest few windows are ever asked for
+            self.conn.execute(
+                "DELETE FROM summaries WHERE user_email = ? AND window_start < ?",
+                (user_email, window_start - 2 * 24 * 3600))
+
+    def get_summary(self, user_email, window_start, max_age):
+        """Returns (found, summary) for a summary of this window computed within `max_age` seconds."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT summary FROM summaries "
+                "WHERE user_email = ? AND window_start = ? AND computed_at >= ?",
+                (user_email, window_start, time.time() - max_age)).fetchone()
+        return (True, row['summary']) if row else (False, None)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = MailStore()
+        return _default_store
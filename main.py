@@ -1,11 +1,31 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
-from typing import List
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import secrets
+import time
 import uvicorn
 
-from email_handler import email_summarizer, no_of_emails, send_message
-from autoreply_agent import run_autoresponder
+from body_parser import shutdown_parse_pool
+from email_handler import (COUNT_MODES, aemail_summarizer, ano_of_emails, aprecompute_summary, asend_message,
+                           asend_messages, count_cache, get_window_start)
+from autoreply_agent import arun_autoresponder
+from jobs import JobManager
+from scheduler import DailySummaryScheduler
+from sse import sse_response
+from gmail_fetch import fetch_stats
+from gmail_service import cache_stats, store_credentials
+from llm_cache import llm_cache
+from metrics import http_seconds, render as render_metrics, start_trace
+from prompt_trim import prompt_stats
+from push_ingest import PUBSUB_TOPIC, PUSH_VERIFICATION_TOKEN, PushIngestor, WatchManager, decode_push
+from rate_limit import limiter_stats
+from token_refresher import TokenRefresher
+from triage import triage_stats
 
 
 class EmailPayload(BaseModel):
@@ -15,6 +35,23 @@ class EmailPayload(BaseModel):
     message: str
 
 
+class DraftPayload(BaseModel):
+    # replies only need reply_to_id (the Gmail id of the email being answered) and message
+    message: str
+    to: Optional[EmailStr] = None
+    subject: Optional[str] = None
+    reply_to_id: Optional[str] = None
+
+
+class BulkEmailPayload(BaseModel):
+    user_email: EmailStr
+    drafts: List[DraftPayload]
+
+
+# Most drafts accepted by one /api/send_emails call
+MAX_BULK_SEND = 100
+
+
 # FastAPI app
 app = FastAPI()
 
@@ -27,16 +64,179 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # a caller-supplied X-Trace-Id (or a new one) tags this request's slow-stage
+    # and error logs, and is echoed back so a failed call can be found in them
+    trace_id = start_trace(request.headers.get("X-Trace-Id"))
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    except Exception as e:
+        print(f"[trace {trace_id}] {request.method} {request.url.path} failed: {e!r}")
+        raise
+    finally:
+        # label by route template, so no user data ends up in metric labels
+        route = request.scope.get("route")
+        http_seconds.observe(time.perf_counter() - start, route=getattr(route, "path", "unmatched"),
+                             method=request.method, status=status)
+    if status >= 500:
+        print(f"[trace {trace_id}] {request.method} {request.url.path} returned {status}")
+    response.headers["X-Trace-Id"] = trace_id
+    return response
+
+
+# Threads for the blocking Gmail / Supabase / SQLite work the async handlers offload
+IO_THREADS = int(os.getenv("IO_THREADS", "100"))
+
+
+@app.on_event("startup")
+async def configure_io_pool():
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io"))
+
+
+@app.on_event("shutdown")
+def stop_parse_pool():
+    shutdown_parse_pool()
+
+
+# Background jobs, so slow pipelines don't hold the HTTP request open
+job_manager = JobManager({
+    'summarize': aemail_summarizer,
+    'auto_respond': arun_autoresponder,
+})
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_manager.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_manager.stop()
+
+
+# Precomputes daily summaries ahead of each user's due time
+summary_scheduler = DailySummaryScheduler(aprecompute_summary)
+
+
+@app.on_event("startup")
+async def start_summary_scheduler():
+    if os.getenv("SUMMARY_SCHEDULER_ENABLED", "1") == "1":
+        summary_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def stop_summary_scheduler():
+    await summary_scheduler.stop()
+
+
+# Renews OAuth tokens shortly before they expire, so requests don't have to
+token_refresher = TokenRefresher(on_refresh=store_credentials)
+
+
+@app.on_event("startup")
+def start_token_refresher():
+    if os.getenv("TOKEN_REFRESHER_ENABLED", "1") == "1":
+        token_refresher.start()
+
+
+@app.on_event("shutdown")
+def stop_token_refresher():
+    token_refresher.stop()
+
+
+# Incremental sync + classification driven by Gmail push notifications, so
+# reads find the mailbox already synced instead of polling Gmail themselves
+push_ingestor = PushIngestor()
+watch_manager = None
+if PUBSUB_TOPIC and not PUSH_VERIFICATION_TOKEN:
+    # without the token anyone could post notifications and start syncs for any user
+    print("PUBSUB_TOPIC is set but PUSH_VERIFICATION_TOKEN is not; push ingestion stays off")
+elif PUBSUB_TOPIC:
+    watch_manager = WatchManager()
+
+
+@app.on_event("startup")
+async def start_push_ingestion():
+    push_ingestor.start()
+    if watch_manager:
+        watch_manager.start()
+
+
+@app.on_event("shutdown")
+async def stop_push_ingestion():
+    if watch_manager:
+        await watch_manager.stop()
+    await push_ingestor.stop()
+
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text format: per-stage timings, LLM tokens, JSON failures, HTTP latency
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache_stats")
+def get_cache_stats():
+    return dict(cache_stats(), llm=llm_cache.stats(), counts=count_cache.stats())
+
+
+@app.get("/api/rate_limit_stats")
+def get_rate_limit_stats():
+    return limiter_stats()
+
+
+@app.get("/api/fetch_stats")
+def get_fetch_stats():
+    return fetch_stats()
+
+
+@app.get("/api/triage_stats")
+def get_triage_stats():
+    return triage_stats()
+
+
+@app.get("/api/prompt_stats")
+def get_prompt_stats():
+    return prompt_stats()
+
+
+@app.get("/api/push_stats")
+def get_push_stats():
+    return push_ingestor.stats()
+
+
+@app.post("/api/gmail/push")
+async def gmail_push(request: Request, token: str = Query("")):
+    # the webhook only works with a shared secret configured
+    if not PUSH_VERIFICATION_TOKEN or not secrets.compare_digest(token, PUSH_VERIFICATION_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid push token")
+
+    try:
+        user_email, history_id = decode_push(await request.json())
+    except ValueError as e:
+        # acknowledge anyway: Pub/Sub would otherwise redeliver it forever
+        print(f"Ignoring push notification: {e}")
+        return Response(status_code=204)
+
+    push_ingestor.submit(user_email, history_id)
+    return Response(status_code=204)
+
+
 @app.post("/api/summarize")
-def summarize_emails(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
+async def summarize_emails(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
     try:
-        summary = email_summarizer(user_email, timezone, since_hour)
+        summary = await aemail_summarizer(user_email, timezone, since_hour)
         return {"summary": summary}
 
     except Exception as e:
@@ -44,9 +244,12 @@ def summarize_emails(user_email: str = Query(...), timezone: str = Query(...), s
 
 
 @app.get("/api/no_of_emails")
-def fetch_emails(user_email: str, timezone: str, since_hour: int = 9):
+async def fetch_emails(user_email: str, timezone: str, since_hour: int = 9, mode: str = "exact"):
+    if mode not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(COUNT_MODES)}")
+
     try:
-        number = no_of_emails(user_email, timezone, since_hour)
+        number = await ano_of_emails(user_email, timezone, since_hour, mode)
         return {"emails_received": number}
 
     except Exception as e:
@@ -54,19 +257,82 @@ def fetch_emails(user_email: str, timezone: str, since_hour: int = 9):
 
 
 @app.post("/api/auto_respond")
-def auto_respond(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
+async def auto_respond(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
     try:
-        result = run_autoresponder(user_email, timezone, since_hour)
+        result = await arun_autoresponder(user_email, timezone, since_hour)
         return {"result": result}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/summarize/stream")
+async def summarize_emails_stream(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
+    # Server-Sent Events: "progress", then a "summary_category" per category as
+    # it is generated, then "done" with the merged summary (or "error")
+    async def run(emit):
+        summary = await aemail_summarizer(
+            user_email, timezone, since_hour,
+            progress=lambda stage: emit("progress", {"stage": stage}), on_event=emit)
+        return {"summary": summary}
+
+    return sse_response(run)
+
+
+@app.get("/api/auto_respond/stream")
+async def auto_respond_stream(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
+    # Server-Sent Events: "progress", a "classification" per email and a "draft"
+    # per draft as each chunk returns, then "done" with the full result (or "error")
+    async def run(emit):
+        result = await arun_autoresponder(
+            user_email, timezone, since_hour,
+            progress=lambda stage: emit("progress", {"stage": stage}), on_event=emit)
+        return {"result": result}
+
+    return sse_response(run)
+
+
+def submit_job(kind, user_email, timezone, since_hour):
+    try:
+        # jobs for the same user and window share one run, however the window was spelled
+        window_key = get_window_start(timezone, since_hour)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = job_manager.submit(kind, user_email, timezone, since_hour, window_key)
+    return {"job_id": job["id"], "status": job["status"]}
+
+
+@app.post("/api/jobs/summarize")
+async def summarize_emails_job(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
+    return submit_job("summarize", user_email, timezone, since_hour)
+
+
+@app.post("/api/jobs/auto_respond")
+async def auto_respond_job(user_email: str = Query(...), timezone: str = Query(...), since_hour: int = Query(9)):
+    return submit_job("auto_respond", user_email, timezone, since_hour)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+
 @app.post("/api/send_email")
 async def send_email(payload: EmailPayload):
 
-    result = send_message(
+    result = await asend_message(
         sender=payload.user_email,
         to=payload.to,
         subject=payload.subject,
@@ -79,5 +345,19 @@ async def send_email(payload: EmailPayload):
     return {"status": "success", "message_id": result["id"]}
 
 
+@app.post("/api/send_emails")
+async def send_emails(payload: BulkEmailPayload):
+    if not 1 <= len(payload.drafts) <= MAX_BULK_SEND:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_BULK_SEND} drafts")
+
+    try:
+        results = await asend_messages(payload.user_email, [draft.model_dump() for draft in payload.drafts])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    sent = sum(result["status"] == "sent" for result in results)
+    return {"sent": sent, "failed": len(results) - sent, "results": results}
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
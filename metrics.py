@@ -0,0 +1,137 @@
+import contextvars
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Stages slower than this are logged along with the request's trace id
+SLOW_STAGE_SECONDS = float(os.getenv("SLOW_STAGE_SECONDS", "5"))
+
+# Trace id of the request being handled; asyncio tasks and asyncio.to_thread carry it along
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+_TRACE_ID = re.compile(r'[\w.-]{1,64}')
+
+registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values -> value
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        # labels must stay user-agnostic (stage, call, route...), never an email or id
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self, key, value):
+        return [f'{self.name}{_label_text(self.labels, key)} {value}']
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(BUCKETS) + 1), 0.0))
+            counts[bisect_left(BUCKETS, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f'{self.name}_bucket{_label_text(self.labels, key, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_label_text(self.labels, key)} {total}')
+        lines.append(f'{self.name}_count{_label_text(self.labels, key)} {cumulative}')
+        return lines
+
+
+stage_seconds = Histogram(
+    'mailbae_stage_seconds', 'Time spent in each pipeline stage', ('stage', 'op'))
+stage_errors = Counter(
+    'mailbae_stage_errors_total', 'Pipeline stage runs that raised', ('stage', 'op'))
+llm_tokens = Counter(
+    'mailbae_llm_tokens_total', 'Estimated LLM tokens sent and received', ('call', 'direction'))
+llm_json_failures = Counter(
+    'mailbae_llm_json_failures_total', 'LLM replies that were not the JSON asked for', ('call',))
+http_seconds = Histogram(
+    'mailbae_http_request_seconds', 'Time to answer each HTTP route', ('route', 'method', 'status'))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return '\n'.join(line for metric in registry for line in metric.render()) + '\n'
+
+
+def start_trace(trace_id=None):
+    """Sets the trace id for the current request (a new one if none, or a malformed one, is given) and returns it."""
+    if not trace_id or not _TRACE_ID.fullmatch(trace_id):
+        trace_id = uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+@contextmanager
+def timed(stage, op=''):
+    """Records how long the block takes under mailbae_stage_seconds{stage, op}."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        stage_errors.inc(stage=stage, op=op)
+        print(f"[trace {current_trace_id() or '-'}] {stage} {op} failed: {e!r}")
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage, op=op)
+        if elapsed >= SLOW_STAGE_SECONDS:
+            print(f"[trace {current_trace_id() or '-'}] slow {stage} {op}: {elapsed:.2f}s")
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import re
+from collections import defaultdict
+from email.utils import parseaddr
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Emails from the same sender whose 64-bit SimHashes differ in at most this many bits are near-duplicates
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "6"))
+# Only each email's first shingles, in text order, are fingerprinted; that's where repeated notifications differ
+MAX_SHINGLES = 256
+# Emails with fewer distinct shingles than this are too short to fingerprint and are never grouped
+MIN_SHINGLES = 5
+
+# Runs of anything but whitespace and punctuation, in any script: \w alone splits words
+# like Hindi ones at their vowel signs. '#' is kept, it stands for masked digits.
+_WORD = re.compile(r'[^\s!-"$-/:-@\[-`{-~\u2000-\u206f\u3000-\u303f\u0964\u0965]+')
+_DIGITS = re.compile(r'\d+')
+
+
+def _bands(max_distance, bits=64):
+    # with max_distance + 1 bands, two hashes within max_distance bits agree on at least one band
+    count = max_distance + 1
+    edges = [bits * i // count for i in range(count + 1)]
+    return [(start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])]
+
+
+def _sender(email):
+    return parseaddr(email.get('from') or '')[1].lower() or (email.get('from') or '').lower()
+
+
+def simhash(text):
+    """
+    64-bit SimHash over the first MAX_SHINGLES distinct word 3-grams, in text
+    order, with digits masked so order/build numbers don't matter. Returns
+    None for text with fewer than MIN_SHINGLES distinct shingles.
+    """
+    words = _WORD.findall(_DIGITS.sub('#', text.lower()))
+    # dict keeps first-seen order, so the sample doesn't depend on string hashing
+    shingles = dict.fromkeys(' '.join(words[i:i + 3]) for i in range(len(words) - 2))
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    weights = [0] * 64
+    for shingle in list(shingles)[:MAX_SHINGLES]:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def cluster_near_duplicates(emails, max_distance=NEAR_DUPLICATE_DISTANCE, mask_digits=True):
+    """
+    Groups near-duplicate emails (same sender, similar subject and body) in
+    linear time with SimHash banding. Returns lists of indexes into `emails`,
+    ordered by their first member; every email is in exactly one cluster.
+    """
+    texts = [f"{email.get('subject') or ''} {email.get('body') or ''}" for email in emails]
+    hashes = [simhash(text) for text in texts]
+    bands = _bands(max_distance)
+    parent = list(range(len(emails)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    by_sender = defaultdict(list)
+    for i, email in enumerate(emails):
+        if hashes[i] is None:
+            continue
+        # without mask_digits, only emails carrying the same numbers can match
+        numbers = None if mask_digits else tuple(_DIGITS.findall(texts[i]))
+        by_sender[(_sender(email), numbers)].append(i)
+
+    for members in by_sender.values():
+        buckets = defaultdict(list)  # (band, band value) -> one email per cluster seen in it
+        for i in members:
+            for band, (shift, mask) in enumerate(bands):
+                seen = buckets[(band, hashes[i] >> shift & mask)]
+                for j in seen:
+                    if find(i) != find(j) and (hashes[i] ^ hashes[j]).bit_count() <= max_distance:
+                        parent[find(i)] = find(j)
+                        break
+                else:
+                    seen.append(i)
+
+    clusters = defaultdict(list)
+    for i in range(len(emails)):
+        clusters[find(i)].append(i)
+    return sorted(clusters.values(), key=lambda cluster: cluster[0])
+
+
+def collapse_near_duplicates(emails, max_distance=NEAR_DUPLICATE_DISTANCE, mask_digits=True):
+    """
+    Returns one representative per near-duplicate cluster: a copy of its
+    first email with `count` (cluster size) and `member_ids` (ids of all the
+    emails it stands for, itself first). Pass mask_digits=False where emails
+    that differ only in numbers (invoice 1001 vs 1002) must stay apart.
+    """
+    clusters = cluster_near_duplicates(emails, max_distance, mask_digits)
+    if len(clusters) < len(emails):
+        print(f"Collapsed {len(emails)} emails into {len(clusters)} after grouping near-duplicates")
+    return [dict(emails[cluster[0]], count=len(cluster),
+                 member_ids=[emails[i].get('id') for i in cluster]) for cluster in clusters]
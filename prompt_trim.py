@@ -0,0 +1,110 @@
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+
+from rate_limit import estimate_tokens
+
+load_dotenv()
+
+# Each email body is cut to about this many tokens before it goes into a prompt
+PROMPT_MAX_EMAIL_TOKENS = int(os.getenv("PROMPT_MAX_EMAIL_TOKENS", "1000"))
+# URLs longer than this are collapsed to their host
+MAX_URL_CHARS = 40
+
+# Where the quoted reply chain starts: everything from here on was already read
+_QUOTE_START = re.compile(
+    r'^[ \t]*(?:'
+    r'On\s[^\n]{0,200}(?:\n[^\n]{0,200})?\swrote:[ \t]*$'        # Gmail / Apple Mail
+    r'|-{2,}\s*Original Message\s*-{2,}'                          # Outlook
+    r'|From:[^\n]+\n(?:Sent|Date):[^\n]+\n'                         # Outlook (no banner)
+    r'|_{20,}[ \t]*$'                                              # Outlook web separator
+    r')', re.IGNORECASE | re.MULTILINE)
+# A forwarded message is new content for the reader, so nothing after this banner is cut as a quote
+_FORWARD_START = re.compile(
+    r'^[ \t]*(?:-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)', re.IGNORECASE | re.MULTILINE)
+_SIGNATURE_START = re.compile(r'^-- ?$', re.MULTILINE)
+# Only matched against the trailing footer (see _footer_start), never the main text
+_BOILERPLATE_LINE = re.compile(
+    r'unsubscribe|view (?:this email |it )?in (?:your|a) browser|manage (?:your )?(?:email )?preferences'
+    r'|you (?:are )?receiv(?:ed|ing) this|all rights reserved|privacy policy|^\s*(?:©|\(c\))'
+    r'|(?:e-?mail|message)(?: and any attachments)? (?:is|are|may be|contains?) (?:confidential|privileged)'
+    r'|^\s*sent from my \w+|^\s*get outlook for',
+    re.IGNORECASE)
+_URL = re.compile(r'https?://([^/\s<>"\')\]]+)[^\s<>"\')\]]*')
+_BLANK_LINES = re.compile(r'\n\s*\n+')
+
+_stats = {'requests': 0, 'tokens_before': 0, 'tokens_after': 0}
+_stats_lock = threading.Lock()
+
+
+def _collapse_url(match):
+    url = match.group(0)
+    return url if len(url) <= MAX_URL_CHARS else f"https://{match.group(1)}/..."
+
+
+def _is_boilerplate(line):
+    # a question is something to answer, whatever words it uses
+    return bool(_BOILERPLATE_LINE.search(line)) and not line.rstrip().endswith('?')
+
+
+def _footer_start(lines):
+    """Index of the first line of the trailing run of boilerplate (and blank) lines."""
+    start = len(lines)
+    while start and (not lines[start - 1].strip() or _is_boilerplate(lines[start - 1])):
+        start -= 1
+    return start
+
+
+def trim_body(body, max_tokens=PROMPT_MAX_EMAIL_TOKENS):
+    """
+    Cuts an email body down to its new content: drops the quoted reply chain,
+    the signature and the boilerplate footer (unsubscribe blocks, legal
+    notices), collapses long URLs and caps the result at about `max_tokens`
+    tokens. Forwarded messages are kept.
+    """
+    text = body or ''
+    forward = _FORWARD_START.search(text)
+    quote = _QUOTE_START.search(text, 0, forward.start() if forward else len(text))
+    # a reply that is nothing but the quote keeps it rather than going empty
+    if quote and text[:quote.start()].strip():
+        text = text[:quote.start()]
+    # a signature above the forward banner would take the forwarded message with it
+    signature = _SIGNATURE_START.search(text, forward.start() if forward else 0)
+    if signature and text[:signature.start()].strip():
+        text = text[:signature.start()]
+
+    lines = [line for line in text.splitlines() if not line.lstrip().startswith('>')]
+    footer = _footer_start(lines)
+    if any(line.strip() for line in lines[:footer]):
+        lines = lines[:footer]
+    text = _BLANK_LINES.sub('\n\n', _URL.sub(_collapse_url, '\n'.join(lines))).strip()
+
+    max_chars = max_tokens * 4
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + ' [...]'
+    return text
+
+
+def trim_emails(emails, label='LLM'):
+    """
+    Returns copies of `emails` with trimmed bodies, and logs the tokens saved
+    for this request (also added to the running totals in prompt_stats()).
+    """
+    trimmed = [dict(email, body=trim_body(email['body'])) for email in emails]
+    before = sum(estimate_tokens(email['body'] or '') for email in emails)
+    after = sum(estimate_tokens(email['body']) for email in trimmed)
+    if emails:
+        print(f"Trimmed {label} prompt bodies from ~{before} to ~{after} tokens "
+              f"({before - after} saved over {len(emails)} emails)")
+    with _stats_lock:
+        _stats['requests'] += 1
+        _stats['tokens_before'] += before
+        _stats['tokens_after'] += after
+    return trimmed
+
+
+def prompt_stats():
+    with _stats_lock:
+        return dict(_stats, tokens_saved=_stats['tokens_before'] - _stats['tokens_after'])
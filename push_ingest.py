@@ -0,0 +1,205 @@
+import asyncio
+import base64
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pub/Sub topic Gmail publishes mailbox changes to (projects/<project>/topics/<topic>);
+# push ingestion is off when it's unset
+PUBSUB_TOPIC = os.getenv("PUBSUB_TOPIC")
+# Shared secret the Pub/Sub push subscription appends to the webhook URL as ?token=
+PUSH_VERIFICATION_TOKEN = os.getenv("PUSH_VERIFICATION_TOKEN")
+INGEST_WORKERS = int(os.getenv("PUSH_INGEST_WORKERS", "4"))
+# Classify new mail as it arrives, so auto-respond finds the results in the LLM cache
+PUSH_PRECLASSIFY = os.getenv("PUSH_PRECLASSIFY", "1") == "1"
+# Gmail watches lapse after 7 days; renew any that end sooner than this
+WATCH_RENEW_BEFORE = 2 * 24 * 3600
+WATCH_CHECK_INTERVAL = 6 * 3600
+WATCH_CONCURRENCY = 10
+
+# WatchManagers running in this process; only then do notifications keep synced stores fresh
+_running_managers = set()
+
+
+def push_active():
+    """True while this process keeps Gmail watches registered and ingests their notifications."""
+    return bool(_running_managers)
+
+
+def decode_push(envelope):
+    """
+    Returns (email_address, history_id) from a Pub/Sub push request body.
+    Raises ValueError if it isn't a Gmail notification.
+    """
+    try:
+        data = json.loads(base64.b64decode(envelope['message']['data']))
+        return data['emailAddress'], int(data['historyId'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"not a Gmail push notification: {e!r}") from e
+
+
+async def ingest_changes(user_email, history_id):
+    """
+    Brings the user's local store up to `history_id` with an incremental sync
+    (which also pre-triages the new mail) and classifies what was added.
+    """
+    from autoreply_agent import aprocess_email
+    from email_handler import add_thread_context, mark_mailbox_changed, sync_mailbox
+    from gmail_service import get_gmail_service
+    from mail_store import get_store
+
+    # counts cached for this user are out of date, even if we don't sync them below
+    mark_mailbox_changed(user_email)
+    store = get_store()
+    state = await asyncio.to_thread(store.get_state, user_email)
+    if state is None:
+        # never synced: the user's first read does the full sync
+        return
+    if int(state['history_id']) >= history_id:
+        return
+
+    service = await asyncio.to_thread(get_gmail_service, user_email)
+    added = await asyncio.to_thread(sync_mailbox, service, user_email, state['synced_since'])
+    if not PUSH_PRECLASSIFY or not added:
+        return
+
+    new = await asyncio.to_thread(store.get_messages, user_email, added)
+    new = [email for email in new if not email['triage']]
+    if new:
+        await asyncio.to_thread(add_thread_context, service, new)
+        await aprocess_email(new)
+
+
+class PushIngestor:
+    """
+    Queue of users with unprocessed push notifications, drained by a few
+    asyncio workers. Notifications for a user already waiting in the queue are
+    coalesced into one run.
+    """
+
+    def __init__(self, process=ingest_changes, workers=INGEST_WORKERS):
+        # process(user_email, history_id) is awaited once per queued user
+        self.process = process
+        self.workers = workers
+        self.pending = {}  # user_email -> newest history id not yet processed
+        self.queue = None
+        self.tasks = []
+        self.received = 0
+        self.coalesced = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, user_email, history_id):
+        self.received += 1
+        if user_email in self.pending:
+            self.pending[user_email] = max(self.pending[user_email], history_id)
+            self.coalesced += 1
+            return
+        self.pending[user_email] = history_id
+        self.queue.put_nowait(user_email)
+
+    async def _worker(self):
+        while True:
+            user_email = await self.queue.get()
+            history_id = self.pending.pop(user_email)
+            try:
+                await self.process(user_email, history_id)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Push ingestion failed for {user_email}: {e!r}")
+            finally:
+                self.queue.task_done()
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'coalesced': self.coalesced,
+            'processed': self.processed,
+            'failed': self.failed,
+            'queued': len(self.pending),
+        }
+
+
+def register_watch(user_email, topic=PUBSUB_TOPIC):
+    """Starts (or renews) the Gmail watch that publishes the user's inbox changes to `topic`."""
+    from gmail_service import get_gmail_service
+    from mail_store import get_store
+
+    service = get_gmail_service(user_email)
+    response = service.users().watch(userId='me', body={
+        'topicName': topic,
+        'labelIds': ['INBOX'],
+        'labelFilterBehavior': 'include',
+    }).execute()
+    get_store().set_watch(user_email, int(response['expiration']) / 1000)
+    return response
+
+
+class WatchManager:
+    """Keeps a Gmail watch registered for every user in the directory, renewing them before they lapse."""
+
+    def __init__(self, directory=None, register=register_watch, interval=WATCH_CHECK_INTERVAL,
+                 concurrency=WATCH_CONCURRENCY):
+        if directory is None:
+            from scheduler import SupabaseUserDirectory
+            directory = SupabaseUserDirectory()
+        self.directory = directory
+        self.register = register
+        self.interval = interval
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.runner = None
+
+    async def _renew(self, user_email):
+        from mail_store import get_store
+
+        expiration = await asyncio.to_thread(get_store().watch_expiration, user_email)
+        if expiration - time.time() > WATCH_RENEW_BEFORE:
+            return False
+        async with self.semaphore:
+            try:
+                await asyncio.to_thread(self.register, user_email)
+                return True
+            except Exception as e:
+                print(f"Registering Gmail watch failed for {user_email}: {e!r}")
+                return False
+
+    async def renew_all(self):
+        """Renews every watch that is missing or close to expiry. Returns how many were registered."""
+        users = await asyncio.to_thread(self.directory.list_users)
+        renewed = await asyncio.gather(*(self._renew(user['email']) for user in users))
+        return sum(renewed)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.renew_all()
+            except Exception as e:
+                print(f"Gmail watch renewal failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.runner is None:
+            self.runner = asyncio.create_task(self._loop())
+            _running_managers.add(self)
+
+    async def stop(self):
+        _running_managers.discard(self)
+        if self.runner:
+            self.runner.cancel()
+            await asyncio.gather(self.runner, return_exceptions=True)
+            self.runner = None
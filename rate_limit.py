@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Gmail quota: 15,000 units per user per minute and 1,200,000 per project per minute
+GMAIL_USER_UNITS_PER_SEC = float(os.getenv("GMAIL_USER_UNITS_PER_SEC", "250"))
+GMAIL_GLOBAL_UNITS_PER_SEC = float(os.getenv("GMAIL_GLOBAL_UNITS_PER_SEC", "20000"))
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "2000"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "4000000"))
+MAX_RATE_LIMIT_RETRIES = 5
+# Gmail tolerates short bursts above the per-second rate
+GMAIL_BURST_SECONDS = 5
+
+# Quota units per Gmail API method, matched against the request path
+GMAIL_METHOD_COSTS = [
+    ('POST', re.compile(r'/messages/send$'), 100),
+    ('POST', re.compile(r'/watch$'), 100),
+    ('POST', re.compile(r'/stop$'), 50),
+    ('GET', re.compile(r'/threads(/[^/]+)?$'), 10),
+    ('GET', re.compile(r'/history$'), 2),
+    ('GET', re.compile(r'/profile$'), 1),
+    ('GET', re.compile(r'/labels(/[^/]+)?$'), 1),
+    ('GET', re.compile(r'/messages(/[^/]+)?$'), 5),
+]
+DEFAULT_GMAIL_COST = 5
+_BATCH_PATH = re.compile(r'/batch(/|$)')
+_BATCH_PART = re.compile(r'^(GET|POST|PUT|PATCH|DELETE) (\S+)', re.MULTILINE)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Callers reserve tokens up front (the bucket may go
+    into debt) and are told how long to wait, which keeps requests in order.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(-self.tokens / self.rate, self.paused_until - now, 0.0)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class QuotaLimiter:
+    """A global token bucket plus one bucket per user (bounded, least recently used evicted)."""
+
+    def __init__(self, per_user_rate, global_rate, burst_seconds=1, max_users=10000):
+        self.per_user_rate = per_user_rate
+        self.burst_seconds = burst_seconds
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate * burst_seconds)
+        self.user_buckets = OrderedDict()
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.waited = 0.0
+        self.backoffs = 0
+
+    def _user_bucket(self, user):
+        with self.lock:
+            bucket = self.user_buckets.get(user)
+            if bucket is None:
+                bucket = self.user_buckets[user] = TokenBucket(
+                    self.per_user_rate, capacity=self.per_user_rate * self.burst_seconds)
+                if len(self.user_buckets) > self.max_users:
+                    self.user_buckets.popitem(last=False)
+            self.user_buckets.move_to_end(user)
+            return bucket
+
+    def reserve(self, cost, user=None):
+        wait = self.global_bucket.reserve(cost)
+        if user is not None:
+            wait = max(wait, self._user_bucket(user).reserve(cost))
+        self.waited += wait
+        return wait
+
+    def acquire(self, cost, user=None):
+        wait = self.reserve(cost, user)
+        if wait:
+            time.sleep(wait)
+
+    def backoff(self, seconds, user=None):
+        """Holds back everyone sharing the throttled quota for `seconds`."""
+        self.backoffs += 1
+        bucket = self._user_bucket(user) if user is not None else self.global_bucket
+        bucket.pause(seconds)
+
+
+class GeminiLimiter:
+    """Requests-per-minute and tokens-per-minute buckets shared by all Gemini calls."""
+
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM):
+        # allow bursts of up to ten seconds' worth of quota
+        self.requests = TokenBucket(rpm / 60, capacity=rpm / 6)
+        self.tokens = TokenBucket(tpm / 60, capacity=tpm / 6)
+        self.waited = 0.0
+        self.backoffs = 0
+
+    def reserve(self, tokens):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        self.waited += wait
+        return wait
+
+    def backoff(self, seconds):
+        self.backoffs += 1
+        self.requests.pause(seconds)
+
+
+gmail_limiter = QuotaLimiter(GMAIL_USER_UNITS_PER_SEC, GMAIL_GLOBAL_UNITS_PER_SEC, GMAIL_BURST_SECONDS)
+gemini_limiter = GeminiLimiter()
+
+
+def gmail_call_cost(method, path):
+    for cost_method, pattern, cost in GMAIL_METHOD_COSTS:
+        if method == cost_method and pattern.search(path):
+            return cost
+    return DEFAULT_GMAIL_COST
+
+
+def gmail_request_cost(uri, method, body=None):
+    """Quota units for one HTTP request; a batch request costs the sum of its parts."""
+    path = uri.split('?', 1)[0]
+    if method == 'POST' and _BATCH_PATH.search(path):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', errors='ignore')
+        parts = _BATCH_PART.findall(body or '')
+        return sum(gmail_call_cost(m, p.split('?', 1)[0]) for m, p in parts) or DEFAULT_GMAIL_COST
+    return gmail_call_cost(method, path)
+
+
+def gmail_retry_after(resp, content):
+    """
+    Returns how long to back off if a Gmail response says we're over quota
+    (429, or 403 with a rateLimitExceeded reason), otherwise None.
+    """
+    if resp.status not in (403, 429):
+        return None
+    if resp.status == 403:
+        try:
+            reasons = {e.get('reason') for e in json.loads(content)['error'].get('errors', [])}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        if not reasons & {'rateLimitExceeded', 'userRateLimitExceeded'}:
+            return None
+    try:
+        return float(resp.get('retry-after', 1))
+    except ValueError:
+        return 1.0
+
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(error):
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    message = str(error)
+    return code == 429 or 'RESOURCE_EXHAUSTED' in message or message.startswith('429')
+
+
+def _retry_delay(error, attempt):
+    # Gemini errors usually say "Please retry in 12.3s"; otherwise back off exponentially
+    match = re.search(r'retry in ([\d.]+)s', str(error))
+    return float(match.group(1)) if match else min(2 ** attempt, 60)
+
+
+async def acall_gemini(fn, prompt_tokens):
+    """Awaits `fn()` within the Gemini quota, waiting and retrying on rate-limit errors."""
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        wait = gemini_limiter.reserve(prompt_tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            return await fn()
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == MAX_RATE_LIMIT_RETRIES:
+                raise
+            gemini_limiter.backoff(_retry_delay(e, attempt))
+
+
+def limiter_stats():
+    return {
+        'gmail': {'waited_seconds': round(gmail_limiter.waited, 3), 'backoffs': gmail_limiter.backoffs},
+        'gemini': {'waited_seconds': round(gemini_limiter.waited, 3), 'backoffs': gemini_limiter.backoffs},
+    }
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from datetime import time as dt_time
+
+import pytz
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCHEDULER_CONCURRENCY = int(os.getenv("SUMMARY_SCHEDULER_CONCURRENCY", "10"))
+# Each due-time bucket is spread over this many seconds leading up to the due time
+SCHEDULER_JITTER = int(os.getenv("SUMMARY_SCHEDULER_JITTER_SECONDS", "600"))
+SCHEDULER_TICK = 30
+USER_REFRESH_INTERVAL = 15 * 60
+
+
+class SupabaseUserDirectory:
+    """Reads each user's timezone / since_hour (and optional summary_hour) from Supabase auth metadata."""
+
+    def __init__(self, client=None, per_page=1000):
+        if client is None:
+            from get_creds import supabase as client
+        self.client = client
+        self.per_page = per_page
+
+    def list_users(self):
+        users = []
+        page = 1
+        while True:
+            batch = self.client.auth.admin.list_users(page=page, per_page=self.per_page)
+            for user in batch:
+                meta = user.user_metadata or {}
+                if not user.email or not meta.get('timezone'):
+                    continue
+                # 0 (midnight) is a valid hour, so only a missing value falls back
+                since_hour = meta.get('since_hour')
+                since_hour = 9 if since_hour is None else int(since_hour)
+                summary_hour = meta.get('summary_hour')
+                users.append({
+                    'email': user.email,
+                    'timezone': meta['timezone'],
+                    'since_hour': since_hour,
+                    'summary_hour': since_hour if summary_hour is None else int(summary_hour),
+                })
+            if len(batch) < self.per_page:
+                return users
+            page += 1
+
+
+def next_due_time(user, now=None):
+    """Epoch seconds of the next time the user's summary is due (summary_hour:00 in their timezone)."""
+    tz = pytz.timezone(user['timezone'])
+    local_now = datetime.fromtimestamp(now or time.time(), tz)
+    for days in (0, 1):
+        day = local_now.date() + timedelta(days=days)
+        # localize each day separately so DST changes land on the right hour
+        due = tz.localize(datetime.combine(day, dt_time(hour=user['summary_hour'])))
+        if due > local_now:
+            return int(due.timestamp())
+
+
+def bucket_by_due_time(users, now=None):
+    buckets = defaultdict(list)
+    for user in users:
+        buckets[next_due_time(user, now)].append(user)
+    return dict(buckets)
+
+
+class DailySummaryScheduler:
+    """
+    Precomputes each user's daily summary ahead of their due time, so that
+    /api/summarize can serve it from the store. Users are bucketed by due time,
+    each bucket is spread at random over the `jitter` seconds before it is due,
+    and at most `concurrency` summaries run at once.
+    """
+
+    def __init__(self, summarize, directory=None, concurrency=SCHEDULER_CONCURRENCY,
+                 jitter=SCHEDULER_JITTER, tick=SCHEDULER_TICK):
+        # summarize(user_email, timezone, since_hour, due) computes and stores the summary due at `due`
+        self.summarize = summarize
+        self.directory = directory or SupabaseUserDirectory()
+        self.jitter = jitter
+        self.tick = tick
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.users = []
+        self.users_loaded_at = 0
+        self.scheduled = set()  # (email, due_ts) already handed out
+        self.tasks = set()
+        self.runner = None
+        self.completed = 0
+        self.failed = 0
+
+    async def _refresh_users(self):
+        if time.time() - self.users_loaded_at < USER_REFRESH_INTERVAL:
+            return
+        self.users = await asyncio.to_thread(self.directory.list_users)
+        self.users_loaded_at = time.time()
+
+    async def _run_one(self, user, due, delay):
+        await asyncio.sleep(delay)
+        async with self.semaphore:
+            try:
+                await self.summarize(user['email'], user['timezone'], user['since_hour'], due)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Scheduled summary failed for {user['email']}: {e!r}")
+
+    def schedule_due(self, now=None):
+        """Starts the runs for every bucket whose jitter window has opened. Returns how many were started."""
+        now = now or time.time()
+        started = 0
+        for due, users in bucket_by_due_time(self.users, now).items():
+            if due - now > self.jitter:
+                continue
+            for user in users:
+                key = (user['email'], due)
+                if key in self.scheduled:
+                    continue
+                self.scheduled.add(key)
+                # spread the bucket over what is left of its jitter window
+                delay = random.uniform(0, max(due - now, 0))
+                task = asyncio.create_task(self._run_one(user, due, delay))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                started += 1
+
+        # forget runs whose due time has passed
+        self.scheduled = {(email, due) for email, due in self.scheduled if due > now - self.jitter}
+        return started
+
+    async def _loop(self):
+        while True:
+            try:
+                await self._refresh_users()
+                self.schedule_due()
+            except Exception as e:
+                print(f"Summary scheduler tick failed: {e!r}")
+            await asyncio.sleep(self.tick)
+
+    def start(self):
+        if self.runner is None:
+            self.runner = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        tasks = list(self.tasks) + ([self.runner] if self.runner else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.runner = None
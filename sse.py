@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+from fastapi.responses import StreamingResponse
+
+# Comment line sent while nothing else is, so proxies don't close an idle stream
+KEEPALIVE_SECONDS = 15
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def event_stream(run):
+    """
+    Runs `run(emit)` in the background and yields each emit(event, data) call
+    as a Server-Sent Event. Ends with a "done" event carrying the return value,
+    or an "error" event. The run is cancelled if the client disconnects.
+    """
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        events.put_nowait((event, data))
+
+    async def runner():
+        try:
+            emit("done", await run(emit))
+        except Exception as e:
+            emit("error", {"detail": str(e)})
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.create_task(runner())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(events.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                return
+            yield format_event(*item)
+    finally:
+        task.cancel()
+
+
+def sse_response(run):
+    return StreamingResponse(event_stream(run), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # stop nginx-style proxies from buffering the stream
+        "X-Accel-Buffering": "no",
+    })
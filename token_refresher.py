@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from get_creds import SCOPES, format_expiry, parse_expiry
+from metrics import timed
+
+load_dotenv()
+
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+# Renew tokens expiring within this window. Must be larger than get_creds.REFRESH_SKEW
+# so the request path finds a fresh token instead of refreshing it itself.
+REFRESH_LEAD = timedelta(minutes=int(os.getenv("TOKEN_REFRESH_LEAD_MINUTES", "10")))
+REFRESH_INTERVAL = int(os.getenv("TOKEN_REFRESH_INTERVAL_SECONDS", "60"))
+REFRESH_CONCURRENCY = int(os.getenv("TOKEN_REFRESH_CONCURRENCY", "8"))
+WRITE_BATCH_SIZE = 50
+SCAN_LIMIT = 1000
+# After a failed refresh (e.g. revoked grant), wait this long before trying that user again
+FAILURE_BACKOFF = 15 * 60
+# Tokens that expired longer ago than this were never renewed (revoked grants, deleted
+# accounts) and are left out of the scan, so they can't fill it ahead of live tokens
+STALE_AFTER = timedelta(days=1)
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SupabaseTokenTable:
+    """The gmail_tokens table in Supabase."""
+
+    def __init__(self, client=None):
+        if client is None:
+            from get_creds import supabase as client
+        self.client = client
+
+    def fetch_expiring(self, before, after, after_user=None):
+        query = (
+            self.client.table("gmail_tokens")
+            .select('user_id, access_token, refresh_token, expires_at')
+            .lt('expires_at', format_expiry(before))
+            .not_.is_('refresh_token', 'null')
+        )
+        if after_user is None:
+            query = query.gt('expires_at', format_expiry(after))
+        else:
+            # keyset cursor: rows after (after, after_user) in (expires_at, user_id) order
+            after = format_expiry(after)
+            query = query.or_(f'expires_at.gt."{after}",'
+                              f'and(expires_at.eq."{after}",user_id.gt."{after_user}")')
+        response = query.order('expires_at').order('user_id').limit(SCAN_LIMIT).execute()
+        return response.data or []
+
+    def write_tokens(self, rows):
+        self.client.table("gmail_tokens").upsert(rows, on_conflict='user_id').execute()
+
+
+class InMemoryTokenTable:
+    """Dict-backed stand-in for gmail_tokens, for local runs and benchmarks."""
+
+    def __init__(self, rows=()):
+        self.rows = {row['user_id']: dict(row) for row in rows}
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def fetch_expiring(self, before, after, after_user=None):
+        cursor = (after, after_user or '')
+        with self.lock:
+            rows = [dict(row) for row in self.rows.values()
+                    if row.get('refresh_token') and row.get('expires_at')
+                    and parse_expiry(row['expires_at']) < before
+                    and (parse_expiry(row['expires_at']), row['user_id']) > cursor]
+        return sorted(rows, key=lambda row: (parse_expiry(row['expires_at']), row['user_id']))[:SCAN_LIMIT]
+
+    def write_tokens(self, rows):
+        with self.lock:
+            self.writes += 1
+            for row in rows:
+                self.rows.setdefault(row['user_id'], {}).update(row)
+
+
+class TokenRefresher:
+    """
+    Periodically renews OAuth tokens that are about to expire, so requests
+    almost never have to refresh a token themselves. Refreshes run with bounded
+    concurrency and the new tokens are written back in batches.
+    """
+
+    def __init__(self, table=None, token_uri=TOKEN_URI, lead=REFRESH_LEAD,
+                 interval=REFRESH_INTERVAL, concurrency=REFRESH_CONCURRENCY,
+                 on_refresh=None):
+        self.table = table or SupabaseTokenTable()
+        self.token_uri = token_uri
+        self.lead = lead
+        self.interval = interval
+        self.concurrency = concurrency
+        # called with (user_id, credentials) after each successful refresh
+        self.on_refresh = on_refresh
+        self.failed_until = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _refresh(self, row):
+        creds = Credentials(
+            token=row.get('access_token'),
+            refresh_token=row['refresh_token'],
+            token_uri=self.token_uri,
+            client_id=os.getenv('GOOGLE_CLIENT_ID'),
+            client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
+            scopes=SCOPES,
+        )
+        with timed('credentials', 'oauth_refresh'):
+            creds.refresh(Request())
+        return creds
+
+    def run_once(self):
+        """Refreshes every token expiring within `lead`. Returns (refreshed, failed)."""
+        now = time.monotonic()
+        self.failed_until = {user: until for user, until in self.failed_until.items() if until > now}
+        utcnow = _utcnow()
+        before, after, after_user = utcnow + self.lead, utcnow - STALE_AFTER, None
+        refreshed = failed = 0
+        # page through the expiring tokens in (expires_at, user_id) order, so users
+        # in backoff are stepped over rather than filling every scan
+        while True:
+            rows = self.table.fetch_expiring(before, after, after_user)
+            if not rows:
+                break
+            page_refreshed, page_failed = self._refresh_rows(
+                [row for row in rows if row['user_id'] not in self.failed_until], now)
+            refreshed += page_refreshed
+            failed += page_failed
+            if len(rows) < SCAN_LIMIT:
+                break
+            after, after_user = parse_expiry(rows[-1]['expires_at']), rows[-1]['user_id']
+        return refreshed, failed
+
+    def _refresh_rows(self, rows, now):
+        if not rows:
+            return 0, 0
+
+        def refresh(row):
+            try:
+                return row, self._refresh(row)
+            except Exception as e:
+                print(f"Token refresh failed for {row['user_id']}: {e!r}")
+                return row, None
+
+        updates = []
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for row, creds in pool.map(refresh, rows):
+                if creds is None:
+                    failed += 1
+                    self.failed_until[row['user_id']] = now + FAILURE_BACKOFF
+                    continue
+                self.failed_until.pop(row['user_id'], None)
+                updates.append({
+                    'user_id': row['user_id'],
+                    'access_token': creds.token,
+                    'refresh_token': creds.refresh_token or row['refresh_token'],
+                    'expires_at': format_expiry(creds.expiry),
+                })
+                if self.on_refresh:
+                    self.on_refresh(row['user_id'], creds)
+
+        for start in range(0, len(updates), WRITE_BATCH_SIZE):
+            self.table.write_tokens(updates[start:start + WRITE_BATCH_SIZE])
+
+        return len(updates), failed
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Token refresher pass failed: {e!r}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,114 @@
+import os
+import re
+import threading
+from collections import Counter
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Headers the rules look at; messages are first fetched with format='metadata' and just these
+TRIAGE_HEADERS = ['From', 'Subject', 'List-Unsubscribe', 'List-Id', 'Precedence',
+                  'Auto-Submitted', 'X-Autoreply', 'X-Autorespond']
+
+# Comma-separated rule names to run (see RULES); empty turns pre-triage off
+TRIAGE_RULES = os.getenv(
+    "TRIAGE_RULES", "list_unsubscribe,bulk_precedence,noreply_sender,category_label,auto_submitted")
+TRIAGE_LABELS = os.getenv("TRIAGE_LABELS", "CATEGORY_PROMOTIONS,CATEGORY_UPDATES")
+TRIAGE_NOREPLY_PATTERN = os.getenv(
+    "TRIAGE_NOREPLY_PATTERN", r'(^|[<\s"._+-])(no-?reply|do-?not-?reply|donotreply|mailer-daemon|notifications?)[@+.-]')
+
+
+_noreply = re.compile(TRIAGE_NOREPLY_PATTERN, re.IGNORECASE)
+_skip_labels = frozenset(filter(None, (label.strip() for label in TRIAGE_LABELS.split(','))))
+
+
+def _header(headers, name):
+    name = name.lower()
+    return next((h['value'] for h in headers if h['name'].lower() == name), None)
+
+
+def list_unsubscribe(headers, labels):
+    if _header(headers, 'List-Unsubscribe') or _header(headers, 'List-Id'):
+        return "Mailing list (has a List-Unsubscribe/List-Id header)"
+
+
+def bulk_precedence(headers, labels):
+    precedence = (_header(headers, 'Precedence') or '').strip().lower()
+    if precedence in ('bulk', 'list', 'junk'):
+        return f"Bulk mail (Precedence: {precedence})"
+
+
+def noreply_sender(headers, labels):
+    sender = _header(headers, 'From') or ''
+    if _noreply.search(sender):
+        return "Sent from a no-reply address"
+
+
+def category_label(headers, labels):
+    matched = sorted(_skip_labels.intersection(labels))
+    if matched:
+        return f"Gmail filed it under {matched[0]}"
+
+
+def auto_submitted(headers, labels):
+    value = (_header(headers, 'Auto-Submitted') or 'no').strip().lower()
+    if value != 'no' or _header(headers, 'X-Autoreply') or _header(headers, 'X-Autorespond'):
+        return "Automatically generated (Auto-Submitted header)"
+
+
+RULES = {
+    'list_unsubscribe': list_unsubscribe,
+    'bulk_precedence': bulk_precedence,
+    'noreply_sender': noreply_sender,
+    'category_label': category_label,
+    'auto_submitted': auto_submitted,
+}
+
+
+def _load_rules(names):
+    rules = []
+    for name in filter(None, (name.strip() for name in names.split(','))):
+        if name not in RULES:
+            raise ValueError(f"Unknown triage rule {name!r} in TRIAGE_RULES; valid rules are {', '.join(RULES)}")
+        rules.append((name, RULES[name]))
+    return rules
+
+
+enabled_rules = _load_rules(TRIAGE_RULES)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def triage_message(msg_data, rules=None):
+    """
+    Runs the pre-triage rules on a message resource (format 'metadata' is
+    enough). Returns the rationale for the first rule that says the message
+    doesn't need a reply, or None if it should go to the classifier.
+    """
+    headers = msg_data.get('payload', {}).get('headers', [])
+    labels = msg_data.get('labelIds', [])
+    for name, rule in enabled_rules if rules is None else rules:
+        rationale = rule(headers, labels)
+        if rationale:
+            with _stats_lock:
+                _stats[f'rule:{name}'] += 1
+            return f"Pre-triage: {rationale}"
+    return None
+
+
+def count_triage(event, n=1):
+    with _stats_lock:
+        _stats[event] += n
+
+
+def triage_stats():
+    """
+    Counts since startup: `bodies_skipped` messages whose body was never
+    downloaded, `llm_skipped` emails answered without an LLM call, and per-rule hits.
+    """
+    with _stats_lock:
+        stats = {'bodies_skipped': 0, 'llm_skipped': 0}
+        stats.update(_stats)
+        return stats